@@ -0,0 +1,74 @@
+#!/usr/bin/env python
+"""Compares the memory use of API result records and plain dicts
+
+Builds a fleet of VM rows (as returned by OCI ListDetails) once as plain
+dicts and once as VmDetails records, each in a fresh interpreter, and
+reports the peak resident memory and build time of both.
+
+Usage: python benchmarks/records.py [--rows N]
+"""
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+CHILD = '''
+import json
+import resource
+import sys
+import time
+sys.path.insert(0, %(root)r)
+sys.path.insert(0, %(root)r + '/oktawave')
+from records import VmDetails
+
+def make(i):
+    return dict(
+        id=100000 + i,
+        name=u'vm-%%06d' %% i,
+        status=i %% 2,
+        class_name=i %% 7,
+        cpu_mhz=2000 + i %% 4000,
+        cpu_usage_mhz=i %% 2000,
+        memory_mb=1024 * (1 + i %% 16),
+        memory_usage_mb=i %% 1024,
+    )
+
+kind = %(kind)r
+before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+start = time.time()
+if kind == 'dict':
+    rows = [make(i) for i in xrange(%(rows)d)]
+else:
+    rows = [VmDetails(**make(i)) for i in xrange(%(rows)d)]
+elapsed = time.time() - start
+after = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+print json.dumps({'time': elapsed, 'kb': after - before, 'row_size': sys.getsizeof(rows[0])})
+'''
+
+
+def measure(kind, rows):
+    out = subprocess.check_output([sys.executable, '-c', CHILD % {'root': ROOT, 'kind': kind, 'rows': rows}])
+    return json.loads(out)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Compare memory use of API records and dicts')
+    parser.add_argument('--rows', type=int, default=100000, help='Number of rows to build (default: 100000)')
+    args = parser.parse_args()
+
+    results = [(kind, measure(kind, args.rows)) for kind in ('dict', 'record')]
+    print '%-8s %12s %12s %10s' % ('Type', 'Memory (MB)', 'Bytes/row', 'Time (s)')
+    for kind, res in results:
+        # ru_maxrss is in kilobytes on Linux
+        print '%-8s %12.1f %12d %10.2f' % (
+            kind, res['kb'] / 1024.0, res['kb'] * 1024 / args.rows, res['time'])
+    print 'Container size of a single row: dict %d bytes, record %d bytes' % (
+        results[0][1]['row_size'], results[1][1]['row_size'])
+
+
+if __name__ == '__main__':
+    sys.exit(main())
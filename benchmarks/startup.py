@@ -0,0 +1,118 @@
+#!/usr/bin/env python
+"""Measures the startup time of oktawave-cli
+
+Every module is imported in a fresh interpreter (a few times, keeping
+the best result), recording the import time and the heavy dependencies
+the import pulled in. The heavy dependencies must only be imported by
+the code paths that use them, so importing any of them on startup is
+reported as an error.
+
+Results can be saved as a baseline (--save FILE) and compared against
+it later (--compare FILE) to catch startup time regressions.
+
+Usage: python benchmarks/startup.py [--repeat N] [--save FILE] [--compare FILE]
+"""
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+MODULES = [
+    'oktawave.cache',
+    'oktawave.client',
+    'oktawave.api',
+    'oktawave.printer',
+    'oktawave.ocs',
+    'oktawave.cli',
+]
+
+# modules that may only be imported by commands which need them
+LAZY_MODULES = ['swiftclient', 'prettytable', 'readline', 'requests', 'multiprocessing', 'argcomplete']
+
+CHILD = '''
+import json
+import sys
+import time
+sys.path.insert(0, %r)
+before = set(sys.modules)
+start = time.time()
+__import__(%r)
+elapsed = time.time() - start
+print json.dumps({'time': elapsed, 'modules': sorted(m for m in sys.modules if m not in before)})
+'''
+
+
+def measure_import(module, repeat):
+    best = None
+    for _i in xrange(repeat):
+        out = subprocess.check_output([sys.executable, '-c', CHILD % (ROOT, module)])
+        res = json.loads(out)
+        if best is None or res['time'] < best['time']:
+            best = res
+    lazy = sorted(set(m.split('.')[0] for m in best['modules']) & set(LAZY_MODULES))
+    return {'time': best['time'], 'modules': len(best['modules']), 'lazy': lazy}
+
+
+def measure_help(repeat):
+    best = None
+    with open(os.devnull, 'w') as devnull:
+        for _i in xrange(repeat):
+            start = time.time()
+            subprocess.call([sys.executable, os.path.join(ROOT, 'oktawave-cli'), '--help'],
+                            stdout=devnull, stderr=devnull)
+            elapsed = time.time() - start
+            if best is None or elapsed < best:
+                best = elapsed
+    return {'time': best, 'modules': None, 'lazy': []}
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Measure oktawave-cli startup time')
+    parser.add_argument('--repeat', type=int, default=5, help='Number of runs per measurement (default: 5)')
+    parser.add_argument('--save', metavar='FILE', help='Save results as a baseline')
+    parser.add_argument('--compare', metavar='FILE', help='Compare results with a saved baseline')
+    parser.add_argument('--tolerance', type=float, default=0.2,
+                        help='Allowed relative slowdown against the baseline (default: 0.2)')
+    args = parser.parse_args()
+
+    results = {}
+    for module in MODULES:
+        results[module] = measure_import(module, args.repeat)
+    results['oktawave-cli --help'] = measure_help(args.repeat)
+
+    baseline = {}
+    if args.compare:
+        with open(args.compare) as fh:
+            baseline = json.load(fh)
+
+    errors = []
+    print '%-22s %10s %8s  %s' % ('Module', 'Time (ms)', 'Modules', 'Baseline (ms)')
+    for name in MODULES + ['oktawave-cli --help']:
+        res = results[name]
+        base = baseline.get(name)
+        print '%-22s %10.1f %8s  %s' % (
+            name, res['time'] * 1000, res['modules'] if res['modules'] is not None else '-',
+            '%.1f' % (base['time'] * 1000) if base else '-')
+        if res['lazy']:
+            errors.append('%s imports %s on startup' % (name, ', '.join(res['lazy'])))
+        # a few milliseconds of slack for noise in very fast imports
+        if base and res['time'] > base['time'] * (1 + args.tolerance) + 0.005:
+            errors.append('%s got slower: %.1f ms (baseline %.1f ms)' % (
+                name, res['time'] * 1000, base['time'] * 1000))
+
+    if args.save:
+        with open(args.save, 'w') as fh:
+            json.dump(results, fh, indent=2)
+
+    for error in errors:
+        print 'ERROR: ' + error
+    return 1 if errors else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
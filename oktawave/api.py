@@ -1,14 +1,13 @@
+import threading
+from itertools import islice
 from time import time
 
+from cache import DictionaryCache
 from client import ApiClient
 from exceptions import *
-
-
-try:
-    from swiftclient import Connection
-except ImportError:
-    # noinspection PyUnresolvedReferences
-    from swift.common.client import Connection
+from parallel import run_parallel, DEFAULT_CONCURRENCY
+from records import (
+    VmSummary, VmDetails, VmInfo, Disk, DatabaseInstance, LogicalDatabase, Container, Opn, HistoryEntry)
 
 # JSON API endpoints
 jsonapi_common = 'https://api.oktawave.com/CommonService.svc/json'
@@ -55,14 +54,47 @@ class TemplateOrigin(object):
     def __str__(self):
         return self.names[self.id]
 
+    def to_json(self):
+        return str(self)
+
+
+class Interned(type):
+    """Metaclass sharing a single instance per (class, intern key)
+
+    Instances are looked up by cls._intern_key(*args) and only created
+    (and initialized) the first time a key is seen, so listing many rows
+    referring to the same few items builds each item once.
+    Classes with INTERNED set to False are instantiated normally.
+    """
+
+    def __init__(cls, name, bases, attrs):
+        super(Interned, cls).__init__(name, bases, attrs)
+        cls._instances = {}
+
+    def __call__(cls, *args):
+        if not cls.INTERNED:
+            return super(Interned, cls).__call__(*args)
+        key = cls._intern_key(*args)
+        try:
+            return cls._instances[key]
+        except KeyError:
+            return cls._instances.setdefault(key, super(Interned, cls).__call__(*args))
+
 
 class PowerStatus(object):
+    __metaclass__ = Interned
+    INTERNED = True
+
     PowerOn = 86
     PowerOff = 87
 
     def __init__(self, status):
         self.status = status
 
+    @classmethod
+    def _intern_key(cls, status):
+        return status
+
     def __str__(self):
         if self.status == self.PowerOn:
             return 'Powered on'
@@ -71,28 +103,68 @@ class PowerStatus(object):
         else:
             return 'unknown status #%d' % self.status
 
+    def __eq__(self, other):
+        if isinstance(other, PowerStatus):
+            return self.status == other.status
+        if isinstance(other, basestring):
+            return str(self) == other
+        return NotImplemented
+
+    def __ne__(self, other):
+        res = self.__eq__(other)
+        if res is NotImplemented:
+            return res
+        return not res
+
+    def __hash__(self):
+        return hash(self.status)
+
+    def to_json(self):
+        return {'id': self.status, 'name': str(self)}
+
 
 class RawDictionaryItem(object):
+    __metaclass__ = Interned
+    INTERNED = True
+
     def __init__(self, item_id, name):
         self.id = item_id
         self.name = name
 
+    @classmethod
+    def _intern_key(cls, item_id, name):
+        # raw items come from different ID spaces (e.g. operation types and
+        # statuses of Account_RunningJobs), so the ID alone is not unique
+        return item_id, name
+
     def __str__(self):
         return self.name
 
     def __int__(self):
         return self.id
 
+    def to_json(self):
+        return {'id': self.id, 'name': self.name}
+
+    def _identity(self):
+        """Returns what tells items apart: the ID alone is not unique, see _intern_key()"""
+        return type(self), self.id, self.name
+
     def __eq__(self, other):
-        try:
-            if str(self) == str(other):
-                return True
-        except ValueError:
-            pass
-        return str(self) == str(other)
+        if isinstance(other, RawDictionaryItem):
+            return self._identity() == other._identity()
+        if isinstance(other, basestring):
+            return self.name == other
+        return NotImplemented
 
     def __ne__(self, other):
-        return not self == other
+        res = self.__eq__(other)
+        if res is NotImplemented:
+            return res
+        return not res
+
+    def __hash__(self):
+        return hash(self._identity())
 
 
 class DictionaryItem(RawDictionaryItem):
@@ -115,8 +187,33 @@ class DictionaryItem(RawDictionaryItem):
             self.ITEM_ID_FIELD: item_id,
         }
 
+    @classmethod
+    def _intern_key(cls, item):
+        return item[cls.ITEM_ID_FIELD]
+
+    def _identity(self):
+        # IDs of one item class are unique
+        return type(self), self.id
+
+
+class Dictionary(object):
+    """Items of an Oktawave dictionary, indexed by name and by ID"""
+
+    def __init__(self, items):
+        self.by_id = {}
+        self.by_name = {}
+        for item in items or []:
+            item = DictionaryItem(item)
+            self.by_id[item.id] = item
+            # the first item with a given name wins, like in a linear search
+            self.by_name.setdefault(item.name, item)
+
+    def __len__(self):
+        return len(self.by_id)
+
 
 class TemplateCategory(DictionaryItem):
+    INTERNED = False
     ITEM_ID_FIELD = 'TemplateCategoryId'
     NAME_LIST_FIELD = 'TemplateCategoryNames'
     NAME_FIELD = 'CategoryName'
@@ -129,6 +226,7 @@ class TemplateCategory(DictionaryItem):
 
 
 class SoftwareItem(DictionaryItem):
+    INTERNED = False
     ITEM_ID_FIELD = 'SoftwareId'
     NAME_LIST_FIELD = 'SoftwareNames'
     NAME_FIELD = 'Name'
@@ -138,18 +236,204 @@ class SoftwareItem(DictionaryItem):
         self.tree_path = '/'.join(self._dict_names(data[self.NAME_LIST_FIELD], self.NAME_FIELD))
 
 
+def select_converters(converters, fields=None):
+    """Returns the converters of the given record fields (all if fields is None)
+
+    Converters are (field, function) pairs building a record field from
+    a raw API dict; listings fill in only the selected fields.
+    """
+    if fields is None:
+        return converters
+    return [(field, convert) for field, convert in converters if field in fields]
+
+
+def convert(converters, data):
+    return dict((field, func(data)) for field, func in converters)
+
+
+def _disk_vms(disk):
+    if disk['VirtualMachineHdds'] is None:
+        return []
+    return [{
+        'id': vm['VirtualMachine']['VirtualMachineId'],
+        'name': vm['VirtualMachine']['VirtualMachineName'],
+        'primary': vm['IsPrimary'],
+        'vm_status': PowerStatus(vm['VirtualMachine']['StatusDictId']),
+    } for vm in disk['VirtualMachineHdds']]
+
+
+VM_SUMMARY_CONVERTERS = (
+    ('id', lambda vm: vm['VirtualMachineId']),
+    ('name', lambda vm: vm['VirtualMachineName']),
+    ('status', lambda vm: PowerStatus(vm['StatusDictId'])),
+)
+
+VM_DETAILS_CONVERTERS = VM_SUMMARY_CONVERTERS + (
+    ('class_name', lambda vm: DictionaryItem(vm['VMClass'])),
+    ('cpu_mhz', lambda vm: vm['CpuMhz']),
+    ('cpu_usage_mhz', lambda vm: vm['CpuMhzUsage']),
+    ('memory_mb', lambda vm: vm['RamMB']),
+    ('memory_usage_mb', lambda vm: vm['RamMBUsage']),
+)
+
+VM_BY_ID_CONVERTERS = (
+    ('name', lambda vm: vm['VirtualMachineName']),
+    ('class_name', lambda vm: DictionaryItem(vm['VMClass'])),
+    ('cpu_mhz', lambda vm: vm['CpuMhz']),
+    ('cpu_usage_mhz', lambda vm: vm['CpuMhzUsage']),
+    ('memory_mb', lambda vm: vm['RamMB']),
+    ('memory_usage_mb', lambda vm: vm['RamMBUsage']),
+    ('creation_date', lambda vm: ApiClient.parse_date(vm['CreationDate'])),
+    ('last_change_date', lambda vm: ApiClient.parse_date(vm['LastChangeDate'])),
+    ('creation_user_name', lambda vm: vm['CreationUserSimple']['FullName']),
+    ('payment_type', lambda vm: DictionaryItem(vm['PaymentType'])),
+    ('autoscaling', lambda vm: DictionaryItem(vm['AutoScalingType'])),
+    ('connection_type', lambda vm: DictionaryItem(vm['ConnectionType'])),
+    ('iops_usage', lambda vm: vm['IopsUsage']),
+)
+
+DISK_CONVERTERS = (
+    ('id', lambda disk: disk['ClientHddId']),
+    ('name', lambda disk: disk['HddName']),
+    ('tier', lambda disk: DictionaryItem(disk['HddStandard'])),
+    ('capacity_gb', lambda disk: disk['CapacityGB']),
+    ('used_gb', lambda disk: disk['UsedCapacityGB']),
+    ('is_shared', lambda disk: disk['IsShared']),
+    ('vms', _disk_vms),
+)
+
+DATABASE_CONVERTERS = (
+    ('id', lambda db: db['VirtualMachineId']),
+    ('name', lambda db: db['VirtualMachineName']),
+    ('type', lambda db: DictionaryItem(db['DatabaseType'])),
+    ('size', lambda db: db['Size']),
+    ('available_space', lambda db: db['AvailableSpace']),
+)
+
+CONTAINER_CONVERTERS = (
+    ('id', lambda c: c['ContainerId']),
+    ('name', lambda c: c['ContainerName']),
+    ('vms', lambda c: c['VirtualMachineCount']),
+)
+
+OPN_CONVERTERS = (
+    ('id', lambda v: v['VlanId']),
+    ('name', lambda v: v['VlanName']),
+    ('address_pool', lambda v: DictionaryItem(v['AddressPool'])),
+    ('payment_type', lambda v: DictionaryItem(v['PaymentType'])),
+)
+
+
+class Endpoint(object):
+    """An API method returning VM fields, as used by plan_vm_listing()
+
+    Arguments:
+    - method (string) - API method name
+    - converters (tuple) - converters of the fields it returns
+    - cost (int) - relative cost of a single call
+    - calls (string) - how many calls are made, for explain()
+    - per_vm (bool) - called once per VM (concurrently), not once per listing?
+    - record_type (class) - record holding its fields
+    """
+
+    def __init__(self, method, converters, cost, calls, per_vm=False, record_type=VmInfo):
+        self.method = method
+        self.converters = converters
+        self.fields = frozenset(field for field, _func in converters)
+        self.cost = cost
+        self.calls = calls
+        self.per_vm = per_vm
+        self.record_type = record_type
+
+
+VM_SIMPLE = Endpoint('GetVirtualMachinesSimple', VM_SUMMARY_CONVERTERS, 1, 'one', record_type=VmSummary)
+VM_SEARCH = Endpoint('GetVirtualMachines', VM_DETAILS_CONVERTERS, 5, 'one per page', record_type=VmDetails)
+VM_BY_ID = Endpoint('GetVirtualMachineById', VM_BY_ID_CONVERTERS, 20, 'one per VM, concurrently', per_vm=True)
+
+VM_FIELDS = VM_SIMPLE.fields | VM_SEARCH.fields | VM_BY_ID.fields
+
+
+class ListingPlan(object):
+    """The API methods chosen by plan_vm_listing() for a set of VM fields"""
+
+    def __init__(self, fields, listing, details=None):
+        self.fields = frozenset(fields)
+        self.listing = listing
+        self.details = details
+
+    @property
+    def endpoints(self):
+        return [self.listing] + ([self.details] if self.details else [])
+
+    @property
+    def cost(self):
+        return sum(endpoint.cost for endpoint in self.endpoints)
+
+    @property
+    def record_type(self):
+        return self.endpoints[-1].record_type
+
+    def detail_fields(self):
+        """Fields taken from the per-VM method (those not returned by the listing)"""
+        return self.fields - self.listing.fields
+
+    def explain(self):
+        """Returns [method, calls, fields] rows describing the plan"""
+        fields = self.fields | set(['id']) if self.details else self.fields
+        rows = [[self.listing.method, self.listing.calls, ', '.join(sorted(fields & self.listing.fields))]]
+        if self.details:
+            rows.append([self.details.method, self.details.calls, ', '.join(sorted(self.detail_fields()))])
+        return rows
+
+
+def plan_vm_listing(fields=None):
+    """Chooses the cheapest API methods returning the given VM fields
+
+    VMs are listed with GetVirtualMachinesSimple or GetVirtualMachines,
+    optionally followed by GetVirtualMachineById for every VM. Returns
+    a ListingPlan; fields default to the ones of OCI_ListDetails.
+    """
+    fields = set(VM_SEARCH.fields if fields is None else fields)
+    unknown = fields - VM_FIELDS
+    if unknown:
+        raise ValueError('unknown VM fields: ' + ', '.join(sorted(unknown)))
+    plans = [
+        ListingPlan(fields, listing, details)
+        for listing in (VM_SIMPLE, VM_SEARCH) for details in (None, VM_BY_ID)
+        if fields <= listing.fields | (details.fields if details else frozenset())]
+    return min(plans, key=lambda plan: plan.cost)
+
+
 class OktawaveApi(object):
-    def __init__(self, username, password, debug=False):
+    def __init__(self, username, password, debug=False, session_cache=None, dictionary_cache=None,
+                 transport=None, retry_policy=None):
         """Initialize the API instance
 
         Arguments:
         - username (string) - Oktawave account username
         - password (string) - Oktawave account password
         - debug (bool) - enable debug output?
+        - session_cache (SessionCache) - on-disk cache of logon results (optional)
+        - dictionary_cache (DictionaryCache) - cache of dictionary items
+          (optional, defaults to an in-memory cache)
+        - transport (HttpTransport) - HTTP connection pool (optional,
+          defaults to the one shared by the whole process)
+        - retry_policy (RetryPolicy) - decides which failed calls are retried
+          (optional, defaults to RetryPolicy())
         """
         self.username = username
         self.password = password
         self.debug = debug
+        self.session_cache = session_cache
+        self._cached_session = False
+        self._relogged_on = False
+        # API methods are called from thread pools, see parallel.run_parallel
+        self._logon_lock = threading.RLock()
+        if dictionary_cache is None:
+            dictionary_cache = DictionaryCache(persistent=False)
+        self.dictionary_cache = dictionary_cache
+        self.transport = transport
+        self.retry_policy = retry_policy
 
     # HELPER METHODS ###
     # methods starting with "_" will not be autodispatched to client commands
@@ -164,7 +448,9 @@ class OktawaveApi(object):
         if hasattr(self, 'common'):
             return
         self.common = ApiClient(
-            jsonapi_common, self.username, self.password, self.debug)
+            jsonapi_common, self.username, self.password, self.debug, self.transport,
+            self.retry_policy)
+        self.common.access_denied_handler = self._relogon
         self._d(self.common)
 
     def _init_clients(self):
@@ -172,7 +458,9 @@ class OktawaveApi(object):
         if hasattr(self, 'clients'):
             return
         self.clients = ApiClient(
-            jsonapi_clients, self.username, self.password, self.debug)
+            jsonapi_clients, self.username, self.password, self.debug, self.transport,
+            self.retry_policy)
+        self.clients.access_denied_handler = self._relogon
         self._d(self.clients)
 
     def _logon(self, only_common=False):
@@ -180,24 +468,63 @@ class OktawaveApi(object):
 
         Returns the User object, as returned by LogonUser.
         Also sets self.client_id for convenience.
+
+        If a session cache is configured, a fresh cached User object
+        is used instead of calling LogonUser.
         """
-        self._init_common()
-        if not only_common:
-            self._init_clients()
-        if hasattr(self, 'client_object'):
-            return self.client_object
-        try:
-            res = self.common.call(
-                'LogonUser',
-                user=self.username,
-                password=self.password,
-                ipAddress=self._get_machine_ip(),
-                userAgent="Oktawave CLI")
-        except AttributeError:
-            raise OktawaveLoginError()
-        self.client_id = res['User']['Client']['ClientId']
-        self.client_object = res
-        return res
+        with self._logon_lock:
+            self._init_common()
+            if not only_common:
+                self._init_clients()
+            if hasattr(self, 'client_object'):
+                return self.client_object
+            res = None
+            if self.session_cache is not None:
+                res = self.session_cache.get(self.username)
+                self._cached_session = res is not None
+            if res is None:
+                try:
+                    res = self.common.call(
+                        'LogonUser',
+                        user=self.username,
+                        password=self.password,
+                        ipAddress=self._get_machine_ip(),
+                        userAgent="Oktawave CLI")
+                except AttributeError:
+                    raise OktawaveLoginError()
+                if self.session_cache is not None:
+                    self.session_cache.set(self.username, res)
+            self.client_id = res['User']['Client']['ClientId']
+            self.client_object = res
+            return res
+
+    def _relogon(self, method, kwargs):
+        """Handles access denied errors for sessions taken from the cache
+
+        Drops the cached session, calls LogonUser again and returns
+        the arguments for retrying the failed call (with the client ID
+        updated), or None if the session was not cached in the first place.
+        Calls rejected concurrently with the cached session are retried
+        with the session of the thread which logged on again first.
+        """
+        with self._logon_lock:
+            if self._cached_session:
+                self._cached_session = False
+                self._relogged_on = True
+                self._d('Cached session rejected by %s, logging on again' % method)
+                self.session_cache.delete(self.username)
+                del self.client_object
+                self._logon(only_common=not hasattr(self, 'clients'))
+            elif not self._relogged_on:
+                return None
+            client_id = self.client_id
+        kwargs = dict(kwargs)
+        if 'clientId' in kwargs:
+            kwargs['clientId'] = client_id
+        search_params = kwargs.get('searchParams')
+        if search_params and 'ClientId' in search_params:
+            kwargs['searchParams'] = dict(search_params, ClientId=client_id)
+        return kwargs
 
     def _simple_vm_method(self, method, vm_id):
         """Wraps around common simple virtual machine method call pattern"""
@@ -209,25 +536,26 @@ class OktawaveApi(object):
         dsp = {
             'ClientId': self.client_id,
         }
-        disks = [d for d in self.clients.call(
-            'GetDisks', searchParams=dsp)['_results'] if d['ClientHddId'] == disk_id]
-        if len(disks) == 0:
-            return None
-        res = disks[0]
-        if res['VirtualMachineHdds'] is None:
-            res['VirtualMachineHdds'] = []
-        return res
+        for res in self.clients.call_paged('GetDisks', dsp):
+            if res['ClientHddId'] == disk_id:
+                if res['VirtualMachineHdds'] is None:
+                    res['VirtualMachineHdds'] = []
+                return res
+        return None
 
     def _get_machine_ip(self):
         return '127.0.0.1'
 
+    def _dictionary(self, dict_id):
+        """Returns a (cached) Dictionary with a given ID"""
+        def fetch():
+            return self.common.call(
+                'GetDictionaryItems', dictionary=dict_id, clientId=self.client_id)
+
+        return self.dictionary_cache.get(dict_id, fetch, Dictionary)
+
     def _dict_item(self, dict_id, key):
-        items = self.common.call(
-            'GetDictionaryItems', dictionary=dict_id, clientId=self.client_id)
-        for item in items:
-            item = DictionaryItem(item)
-            if item.name == key:
-                return item
+        return self._dictionary(dict_id).by_name.get(key)
 
     def _oci_class(self, class_name):
         """Returns a dictionary item for OCI class with a given name"""
@@ -311,11 +639,23 @@ class OktawaveApi(object):
                 'creation_user_name': op['CreationUserFullName'],
                 'type': RawDictionaryItem(op['OperationTypeId'], op['OperationTypeName']),
                 'object_type': RawDictionaryItem(op['ObjectTypeId'], op['ObjectTypeName']),
+                'object_id': op.get('ObjectId'),
                 'object_name': op['ObjectName'],
-                'progress_percent': op['Progress'],
+                'progress_percent': op['Progress'] or 0,
                 'status': RawDictionaryItem(op['StatusId'], op['StatusName'])
             }
 
+    def Account_RefreshCache(self):
+        """Drops cached dictionaries and downloads the commonly used ones again
+
+        Returns a dict mapping dictionary IDs to item counts.
+        """
+        self._logon()
+        self.dictionary_cache.invalidate()
+        return dict(
+            (dict_id, len(self._dictionary(dict_id)))
+            for dict_id in (DICT['OCI_CLASSES_DICT_ID'], DICT['OVS_TIERS_DICT_ID']))
+
     def Account_Users(self):
         """Print users in client account."""
         self._logon()
@@ -379,35 +719,68 @@ class OktawaveApi(object):
 
     ### OCI (VMs) ###
 
-    def OCI_List(self):
-        """Lists client's virtual machines' basic info"""
+    def OCI_List(self, fields=None):
+        """Lists client's virtual machines' basic info
+
+        If fields are given, only these fields of the records are filled in.
+        """
         self._logon()
         vms = self.clients.call('GetVirtualMachinesSimple', clientId=self.client_id)
         self._d(vms)
+        converters = select_converters(VM_SUMMARY_CONVERTERS, fields)
         for vm in vms:
-            yield {
-                'id': vm['VirtualMachineId'],
-                'name': vm['VirtualMachineName'],
-                'status': PowerStatus(vm['StatusDictId']),
-            }
+            yield VmSummary(**convert(converters, vm))
 
-    def OCI_ListDetails(self):
-        """Lists client's virtual machines"""
+    def OCI_ListDetails(self, page_size=None, max_items=None, fields=None):
+        """Lists client's virtual machines (see OCI_List for fields)"""
         self._logon()
         sp = {'ClientId': self.client_id}
-        vms = self.clients.call('GetVirtualMachines', searchParams=sp)
-        self._d(vms)
-        for vm in vms['_results']:
-            yield {
-                'id': vm['VirtualMachineId'],
-                'name': vm['VirtualMachineName'],
-                'status': PowerStatus(vm['StatusDictId']),
-                'class_name': DictionaryItem(vm['VMClass']),
-                'cpu_mhz': vm['CpuMhz'],
-                'cpu_usage_mhz': vm['CpuMhzUsage'],
-                'memory_mb': vm['RamMB'],
-                'memory_usage_mb': vm['RamMBUsage'],
-            }
+        converters = select_converters(VM_DETAILS_CONVERTERS, fields)
+        for vm in self.clients.call_paged('GetVirtualMachines', sp, page_size, max_items):
+            yield VmDetails(**convert(converters, vm))
+
+    def OCI_Select(self, fields=None, concurrency=DEFAULT_CONCURRENCY, plan=None, prefilter=None):
+        """Lists VMs with the given fields, using the cheapest API methods
+
+        The methods are chosen by plan_vm_listing(fields) (unless a plan
+        is given). Per-VM calls are made concurrently, for a few batches
+        of VMs at a time, so stopping early saves the remaining calls.
+        prefilter(row) may skip VMs before their details are fetched, it
+        gets a dict of the fields returned by the listing.
+        Yields records of plan.record_type.
+        """
+        if plan is None:
+            plan = plan_vm_listing(fields)
+        self._logon()
+        if plan.listing is VM_SIMPLE:
+            vms = self.clients.call('GetVirtualMachinesSimple', clientId=self.client_id)
+        else:
+            vms = self.clients.call_paged('GetVirtualMachines', {'ClientId': self.client_id})
+        # the ID is needed to fetch the details
+        converters = select_converters(plan.listing.converters, plan.fields | set(['id']))
+        rows = (convert(converters, vm) for vm in vms)
+        if prefilter is not None:
+            rows = (row for row in rows if prefilter(row))
+        if plan.details is None:
+            for row in rows:
+                yield plan.record_type(**row)
+            return
+
+        detail_converters = select_converters(plan.details.converters, plan.detail_fields())
+
+        def details(row):
+            return convert(detail_converters, self._simple_vm_method(plan.details.method, row['id']))
+
+        batch_size = 4 * max(1, concurrency)
+        while True:
+            batch = list(islice(rows, batch_size))
+            if not batch:
+                return
+            for row, values, error in run_parallel(details, batch, concurrency):
+                if error is not None:
+                    raise error
+                row.update(values)
+                yield plan.record_type(**row)
 
     def OCI_Restart(self, oci_id):
         """Restarts given VM"""
@@ -433,34 +806,63 @@ class OktawaveApi(object):
         """Deletes given virtual machine"""
         self._simple_vm_method('DeleteVirtualMachine', oci_id)
 
-    def OCI_Logs(self, oci_id):
-        """Shows virtual machine logs"""
+    def OCI_Logs(self, oci_id, since=None, until=None, types=None, page_size=None, max_items=None):
+        """Shows virtual machine logs, newest first
+
+        Arguments:
+        - oci_id (int) - virtual machine ID
+        - since (datetime) - skip entries older than this (optional)
+        - until (datetime) - skip entries newer than this (optional)
+        - types (list) - only return entries of these operation types,
+          compared case-insensitively (optional)
+        - page_size (int) - number of entries downloaded at once (optional)
+        - max_items (int) - return at most this many entries (optional)
+
+        The history is downloaded page by page only until the
+        oldest entry within the requested time range is reached.
+        """
+        if max_items is not None and max_items <= 0:
+            return
+        if types is not None:
+            types = set(t.lower() for t in types)
         self._logon()
         sp = {
             'VirtualMachineId': oci_id,
-            'PageSize': 100,
             'SortingDirection': 0,  # descending
         }
-        data = self.clients.call(
-            'GetVirtualMachineHistories', searchParams=sp, clientId=self.client_id)
-        self._d(data)
-        for op in data['_results']:
-            yield {
-                'time': self.clients.parse_date(op['CreationDate']),
-                'type': DictionaryItem(op['OperationType']),
-                'user_name': op['CreationUser']['FullName'],
-                'status': DictionaryItem(op['Status']),
-                'parameters': [item['Value'] for item in op['Parameters']],
-            }
+        count = 0
+        for op in self.clients.call_paged(
+                'GetVirtualMachineHistories', sp, page_size, clientId=self.client_id):
+            op_time = self.clients.parse_date(op['CreationDate'])
+            if since is not None and op_time < since:
+                return
+            if until is not None and op_time > until:
+                continue
+            op_type = DictionaryItem(op['OperationType'])
+            if types is not None and str(op_type).lower() not in types:
+                continue
+            yield HistoryEntry(
+                time=op_time,
+                type=op_type,
+                user_name=op['CreationUser']['FullName'],
+                status=DictionaryItem(op['Status']),
+                parameters=[item['Value'] for item in op['Parameters']],
+            )
+            count += 1
+            if count == max_items:
+                return
 
     def OCI_DefaultPassword(self, oci_id):
-        logs = self.OCI_Logs(oci_id)
-        for entry in logs:
-            if entry['type'] == 'Instance access details':
-                try:
-                    return entry['parameters'][0]
-                except IndexError:
-                    return  # no data yet
+        """Returns the password from the newest "Instance access details" log entry
+
+        Stops downloading the history as soon as the entry is found.
+        Returns None if there is no such entry (or it has no data yet).
+        """
+        for entry in self.OCI_Logs(oci_id, types=['Instance access details'], max_items=1):
+            try:
+                return entry['parameters'][0]
+            except IndexError:
+                return  # no data yet
 
     def OCI_Settings(self, oci_id):
         """Shows basic VM settings (IP addresses, OS, names, autoscaling etc.)"""
@@ -569,32 +971,15 @@ class OktawaveApi(object):
 
     # OVS (disks) ###
 
-    def OVS_List(self):
-        """Lists disks"""
+    def OVS_List(self, page_size=None, max_items=None, fields=None):
+        """Lists disks (see OCI_List for fields)"""
         self._logon()
         dsp = {
             'ClientId': self.client_id,
         }
-        data = self.clients.call('GetDisks', searchParams=dsp)
-        for disk in data['_results']:
-            if disk['VirtualMachineHdds'] is None:
-                vms = []
-            else:
-                vms = [{
-                    'id': vm['VirtualMachine']['VirtualMachineId'],
-                    'name': vm['VirtualMachine']['VirtualMachineName'],
-                    'primary': vm['IsPrimary'],
-                    'vm_status': PowerStatus(vm['VirtualMachine']['StatusDictId']),
-                } for vm in disk['VirtualMachineHdds']]
-            yield {
-                'id': disk['ClientHddId'],
-                'name': disk['HddName'],
-                'tier': DictionaryItem(disk['HddStandard']),
-                'capacity_gb': disk['CapacityGB'],
-                'used_gb': disk['UsedCapacityGB'],
-                'is_shared': disk['IsShared'],
-                'vms': vms,
-            }
+        converters = select_converters(DISK_CONVERTERS, fields)
+        for disk in self.clients.call_paged('GetDisks', dsp, page_size, max_items):
+            yield Disk(**convert(converters, disk))
 
     def OVS_Delete(self, ovs_id):
         """Deletes a disk"""
@@ -680,21 +1065,15 @@ class OktawaveApi(object):
 
     # ORDB (databases) ###
 
-    def ORDB_List(self):
-        """Lists databases"""
+    def ORDB_List(self, page_size=None, max_items=None, fields=None):
+        """Lists databases (see OCI_List for fields)"""
         self._logon()
         sp = {
             'ClientId': self.client_id,
         }
-        data = self.clients.call('GetDatabaseInstances', searchParams=sp)
-        for db in data['_results']:
-            yield {
-                'id': db['VirtualMachineId'],
-                'name': db['VirtualMachineName'],
-                'type': DictionaryItem(db['DatabaseType']),
-                'size': db['Size'],
-                'available_space': db['AvailableSpace'],
-            }
+        converters = select_converters(DATABASE_CONVERTERS, fields)
+        for db in self.clients.call_paged('GetDatabaseInstances', sp, page_size, max_items):
+            yield DatabaseInstance(**convert(converters, db))
 
     ORDB_TurnOn = OCI_TurnOn
     ORDB_TurnOff = OCI_TurnOff
@@ -713,28 +1092,26 @@ class OktawaveApi(object):
 
     ORDB_Logs = OCI_Logs
 
-    def ORDB_LogicalDatabases(self, oci_id):
+    def ORDB_LogicalDatabases(self, oci_id, page_size=None):
         """Shows logical databases"""
         self._logon()
         sp = {
             'ClientId': self.client_id,
         }
-        data = self.clients.call('GetDatabaseInstances', searchParams=sp)
-
-        for vm in data['_results']:
+        for vm in self.clients.call_paged('GetDatabaseInstances', sp, page_size):
             if oci_id is not None and str(vm['VirtualMachineId']) != str(oci_id):
                 continue
 
             for db in vm['Databases']:
-                yield {
-                    'id': db['VirtualMachineId'],
-                    'name': db['DatabaseName'],
-                    'type': DictionaryItem(db['DatabaseType']),
-                    'encoding': db['Encoding'],
-                    'is_running': db['IsRunning'],
-                    'qps': db['QPS'],
-                    'size': db['Size']
-                }
+                yield LogicalDatabase(
+                    id=db['VirtualMachineId'],
+                    name=db['DatabaseName'],
+                    type=DictionaryItem(db['DatabaseType']),
+                    encoding=db['Encoding'],
+                    is_running=db['IsRunning'],
+                    qps=db['QPS'],
+                    size=db['Size']
+                )
 
     ORDB_Settings = OCI_Settings
 
@@ -818,16 +1195,13 @@ class OktawaveApi(object):
                           databaseName=name, backupFileName=backup_file,
                           clientId=self.client_id)
 
-    def Container_List(self):
-        """Lists client's containers' basic info"""
+    def Container_List(self, fields=None):
+        """Lists client's containers' basic info (see OCI_List for fields)"""
         self._logon()
         containers = self.clients.call('GetContainers', clientId=self.client_id)
+        converters = select_converters(CONTAINER_CONVERTERS, fields)
         for c in containers:
-            yield {
-                'id': c['ContainerId'],
-                'name': c['ContainerName'],
-                'vms': c['VirtualMachineCount']
-            }
+            yield Container(**convert(converters, c))
 
     def Container_Get(self, container_id):
         """Displays a container's information"""
@@ -873,6 +1247,20 @@ class OktawaveApi(object):
                 'status': PowerStatus(vms['StatusDictId'])
             }
 
+    def Container_Memberships(self):
+        """Returns the VMs of all containers, in a dict keyed by container ID
+
+        Uses a single GetContainersSimpleWithVM call; VMs are described like
+        in Container_OCIList.
+        """
+        self._logon()
+        cs = self.clients.call('GetContainersSimpleWithVM', clientId=self.client_id)
+        return dict((c['ContainerId'], [{
+            'oci_id': vm['VirtualMachineSimple']['VirtualMachineId'],
+            'oci_name': vm['VirtualMachineSimple']['VirtualMachineName'],
+            'status': PowerStatus(vm['VirtualMachineSimple']['StatusDictId'])
+        } for vm in c['VirtualMachines']]) for c in cs)
+
     def Container_RemoveOCI(self, container_id, oci_id):
         """Removes an instance from container"""
         self._logon()
@@ -987,29 +1375,25 @@ class OktawaveApi(object):
         pools = {'10.0.0.0/24': 278, '192.168.0.0/24': 279}
         return pools[name]
 
-    def OPN_List(self):
-        """Lists client's OPNs"""
+    def OPN_List(self, fields=None):
+        """Lists client's OPNs (see OCI_List for fields)"""
         self._logon()
         vlans = self.clients.call('GetVlansByClientId', clientId=self.client_id)
+        converters = select_converters(OPN_CONVERTERS, fields)
         for v in vlans:
-            yield {
-                'id': v['VlanId'],
-                'name': v['VlanName'],
-                'address_pool': DictionaryItem(v['AddressPool']),
-                'payment_type': DictionaryItem(v['PaymentType'])
-            }
+            yield Opn(**convert(converters, v))
 
     def OPN_Get(self, opn_id):
         self._logon()
         v = self.clients.call('GetVlanById', vlanId=opn_id, clientId=self.client_id)
         vms = self.clients.call('GetVirtualMachineVlansByVlanId', vlanId=opn_id, clientId=self.client_id)
-        return {
-            'id': v['VlanId'],
-            'name': v['VlanName'],
-            'address_pool': DictionaryItem(v['AddressPool']),
-            'payment_type': DictionaryItem(v['PaymentType']),
-            'vms': vms
-        }
+        return Opn(
+            id=v['VlanId'],
+            name=v['VlanName'],
+            address_pool=DictionaryItem(v['AddressPool']),
+            payment_type=DictionaryItem(v['PaymentType']),
+            vms=vms
+        )
 
     def OPN_Create(self, name, address_pool):
         self._logon()
@@ -1062,7 +1446,32 @@ class OktawaveApi(object):
         return self.clients.call('UpdateVlan', vlan=vlan)
 
 
-class OCSConnection(Connection):
-    def __init__(self, username, password):
-        super(OCSConnection, self).__init__(
-            'https://ocs-pl.oktawave.com/auth/v1.0', username, password)
+class OCSConnection(object):
+    """Connection to OCS (Swift)
+
+    Wraps a swiftclient Connection, delegating all its methods.
+    swiftclient is imported only when a connection is created, so that
+    commands which do not use OCS do not pay for importing it.
+    """
+
+    AUTH_URL = 'https://ocs-pl.oktawave.com/auth/v1.0'
+
+    def __init__(self, username, password, **kwargs):
+        try:
+            from swiftclient import Connection
+        except ImportError:
+            # noinspection PyUnresolvedReferences
+            from swift.common.client import Connection
+        self.connection = Connection(self.AUTH_URL, username, password, **kwargs)
+
+    def __getattr__(self, name):
+        if name == 'connection':
+            raise AttributeError(name)
+        return getattr(self.connection, name)
+
+    def clone(self):
+        """Returns a new connection (e.g. for another thread) sharing this one's auth token"""
+        conn = self.connection
+        if not (conn.url and conn.token):
+            conn.url, conn.token = conn.get_auth()
+        return OCSConnection(conn.user, conn.key, preauthurl=conn.url, preauthtoken=conn.token)
@@ -0,0 +1,194 @@
+import errno
+import json
+import os
+from contextlib import contextmanager
+from time import time
+
+try:
+    import fcntl
+except ImportError:
+    # no advisory locking available (e.g. on Windows)
+    fcntl = None
+
+DEFAULT_CACHE_DIR = '~/.oktawave-cli'
+
+
+class FileCache(object):
+    """A small JSON key/value store with per-entry expiry
+
+    The store lives in a single file under cache_dir and is shared between
+    concurrently running oktawave-cli processes, so every access takes
+    an advisory lock on a companion .lock file. The cache is best-effort:
+    any I/O problem makes it behave as if it were empty.
+    """
+
+    def __init__(self, name, ttl, cache_dir=DEFAULT_CACHE_DIR):
+        """Initialize the cache
+
+        Arguments:
+        - name (string) - file name within cache_dir
+        - ttl (int) - entry lifetime in seconds, 0 disables the cache
+        - cache_dir (string) - directory holding the cache files
+        """
+        self.cache_dir = os.path.expanduser(cache_dir)
+        self.path = os.path.join(self.cache_dir, name)
+        self.ttl = ttl
+
+    @contextmanager
+    def _locked(self, exclusive=False):
+        if not os.path.isdir(self.cache_dir):
+            os.makedirs(self.cache_dir, 0700)
+        fd = os.open(self.path + '.lock', os.O_RDWR | os.O_CREAT, 0600)
+        try:
+            if fcntl is not None:
+                fcntl.flock(fd, fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH)
+            yield
+        finally:
+            os.close(fd)
+
+    def _read(self):
+        try:
+            with open(self.path) as fh:
+                data = json.load(fh)
+        except IOError as e:
+            if e.errno != errno.ENOENT:
+                raise
+            return {}
+        except ValueError:
+            # corrupted file, start from scratch
+            return {}
+        if not isinstance(data, dict):
+            return {}
+        return data
+
+    def _write(self, data):
+        tmp_path = '%s.%d.tmp' % (self.path, os.getpid())
+        fd = os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0600)
+        with os.fdopen(fd, 'w') as fh:
+            json.dump(data, fh)
+        os.rename(tmp_path, self.path)
+
+    def _is_fresh(self, entry, now):
+        return entry['time'] + self.ttl > now
+
+    def get(self, key):
+        """Returns the value stored under key or None if missing/expired"""
+        if not self.ttl:
+            return None
+        try:
+            with self._locked():
+                data = self._read()
+        except (IOError, OSError):
+            return None
+        entry = data.get(key)
+        if entry is None or not self._is_fresh(entry, time()):
+            return None
+        return entry['value']
+
+    def set(self, key, value):
+        """Stores value under key, dropping expired entries on the way"""
+        if not self.ttl:
+            return
+        now = time()
+        try:
+            with self._locked(exclusive=True):
+                data = self._read()
+                data = dict((k, v) for k, v in data.iteritems() if self._is_fresh(v, now))
+                data[key] = {'time': now, 'value': value}
+                self._write(data)
+        except (IOError, OSError):
+            pass
+
+    def delete(self, key):
+        """Removes key from the cache"""
+        try:
+            with self._locked(exclusive=True):
+                data = self._read()
+                if data.pop(key, None) is not None:
+                    self._write(data)
+        except (IOError, OSError):
+            pass
+
+    def clear(self):
+        """Removes all entries from the cache"""
+        try:
+            with self._locked(exclusive=True):
+                self._write({})
+        except (IOError, OSError):
+            pass
+
+
+class SessionCache(FileCache):
+    """Caches LogonUser results per username between oktawave-cli runs"""
+
+    DEFAULT_TTL = 3600
+
+    def __init__(self, ttl=DEFAULT_TTL, cache_dir=DEFAULT_CACHE_DIR):
+        super(SessionCache, self).__init__('sessions', ttl, cache_dir)
+
+
+class IndexCache(object):
+    """Cache of lookup indexes built from API listings
+
+    Raw listings are kept on disk (unless persistent is False) and the
+    indexes built from them are kept in memory, both for ttl seconds.
+    A ttl of 0 disables caching altogether.
+    """
+
+    FILE_NAME = None
+    DEFAULT_TTL = None
+
+    def __init__(self, ttl=None, persistent=True, cache_dir=DEFAULT_CACHE_DIR):
+        if ttl is None:
+            ttl = self.DEFAULT_TTL
+        self.ttl = ttl
+        self.disk = FileCache(self.FILE_NAME, ttl, cache_dir) if persistent else None
+        self._memory = {}
+
+    def get(self, key, fetch, build, refresh=False):
+        """Returns build(items) for a listing
+
+        fetch() is called to download the items only if they are not
+        cached in memory or on disk, or if refresh is True.
+        """
+        now = time()
+        if not refresh:
+            entry = self._memory.get(key)
+            if entry is not None and entry[0] + self.ttl > now:
+                return entry[1]
+        items = None
+        if self.disk is not None and not refresh:
+            items = self.disk.get(str(key))
+        if items is None:
+            items = fetch()
+            if self.disk is not None:
+                self.disk.set(str(key), items)
+        index = build(items)
+        if self.ttl:
+            self._memory[key] = (now, index)
+        return index
+
+    def invalidate(self, key=None):
+        """Drops a single listing (or all of them) from the cache"""
+        if key is None:
+            self._memory.clear()
+            if self.disk is not None:
+                self.disk.clear()
+        else:
+            self._memory.pop(key, None)
+            if self.disk is not None:
+                self.disk.delete(str(key))
+
+
+class DictionaryCache(IndexCache):
+    """Cache of Oktawave dictionaries keyed by dictionary ID"""
+
+    FILE_NAME = 'dictionaries'
+    DEFAULT_TTL = 86400
+
+
+class NameCache(IndexCache):
+    """Cache of name to ID mappings keyed by username and resource type"""
+
+    FILE_NAME = 'names'
+    DEFAULT_TTL = 300
@@ -1,7 +1,13 @@
 import sys
 import os
-import readline
 import shlex
+import sqlite3
+import time
+import argparse
+import datetime
+from fnmatch import fnmatchcase
+from itertools import chain
+from functools import wraps
 
 from oktawave.api import (
     OktawaveApi,
@@ -10,10 +16,20 @@ from oktawave.api import (
     CloneType,
     TemplateType,
     PowerStatus,
-    TemplateOrigin
+    TemplateOrigin,
+    plan_vm_listing
 )
+from oktawave.cache import SessionCache, DictionaryCache, NameCache
+from oktawave.client import HttpTransport, RetryPolicy
 from oktawave.exceptions import *
+from oktawave.inventory import Inventory, TABLES, DEFAULT_DETAILS_MAX_AGE
+from oktawave.listing import Column, ListQuery, ListQueryError, POWER_STATUS_ALIASES
+from oktawave.ocs import SegmentedUpload, RangedDownload, DirectorySync, MB, list_objects
+from oktawave.parallel import run_parallel
 from oktawave.printer import Printer
+from oktawave.top import Sampler, TopScreen, number_column, gauge_columns, percent
+from oktawave.records import VmSummary, VmDetails
+from oktawave.waiter import OperationWaiter
 
 
 class Completer(object):
@@ -29,6 +45,8 @@ class Completer(object):
         return tokens
                 
     def complete(self, text, stage):
+        import readline
+
         buf = ' ' + readline.get_line_buffer()
         tokens = self.tokenize(buf)
         if buf[-1].isspace():
@@ -52,6 +70,43 @@ class OktawaveDuplicateName(ValueError):
     pass
 
 
+class NameIndex(object):
+    """Maps item names of a single resource type to their IDs"""
+
+    def __init__(self, items):
+        self.ids = {}
+        for item_id, item_name in items:
+            self.ids.setdefault(item_name, []).append(item_id)
+
+    def __contains__(self, name):
+        return name in self.ids
+
+    def name_of(self, item_id):
+        """Returns the name of the item with a given ID, None if unknown"""
+        if not hasattr(self, 'names'):
+            self.names = dict((i, name) for name, ids in self.ids.iteritems() for i in ids)
+        return self.names.get(item_id)
+
+    def lookup(self, name):
+        ids = self.ids.get(name)
+        if not ids:
+            raise OktawaveNameNotFound(name)
+        if len(ids) > 1:
+            raise OktawaveDuplicateName(name)
+        return ids[0]
+
+    def match(self, pattern):
+        """Returns (ID, name) pairs of all items with names matching a shell-style pattern"""
+        return sorted(
+            (item_id, name)
+            for name, ids in self.ids.iteritems() if fnmatchcase(name, pattern)
+            for item_id in ids)
+
+
+def is_name_pattern(name):
+    return isinstance(name, basestring) and any(c in name for c in '*?[')
+
+
 class NamedItemId(object):
     def __init__(self, item_id):
         self.item_id = item_id
@@ -60,23 +115,97 @@ class NamedItemId(object):
     def list_items(cls, api):
         raise NotImplementedError()
 
-    def as_int(self, api):
-        try:
-            return int(self.item_id)
-        except ValueError:
-            pass
+    @classmethod
+    def resolve(cls, api, item_ids, cache=None):
+        """Converts a list of IDs and/or names to integer IDs
+
+        All names are looked up in a single NameIndex, taken from cache
+        (a NameCache) if possible. A cached index that lacks any of the
+        names is rebuilt from a fresh listing before giving up.
+        """
+        names = []
+        for item_id in item_ids:
+            try:
+                int(item_id)
+            except ValueError:
+                names.append(item_id)
+
+        index = None
+        if names:
+            index, fetched = cls._name_index(api, cache)
+            if not fetched and not all(name in index for name in names):
+                index, fetched = cls._name_index(api, cache, refresh=True)
+
+        res = []
+        for item_id in item_ids:
+            try:
+                res.append(int(item_id))
+            except ValueError:
+                res.append(index.lookup(item_id))
+        return res
+
+    @classmethod
+    def expand(cls, api, item_ids, cache=None, matches=None):
+        """Like resolve(), but also accepts shell-style name patterns
+
+        Patterns (e.g. "web-*") are matched against a fresh listing and
+        expand to the IDs of all matching items; a name which looks like
+        a pattern but is the exact name of an item is not expanded.
+        Every ID is returned once.
+
+        Arguments:
+        - matches (dict) - if given, every expanded pattern is stored in it,
+          mapped to the (ID, name) pairs it matched
+        """
+        if not any(is_name_pattern(item_id) for item_id in item_ids):
+            res = cls.resolve(api, item_ids, cache)
+        else:
+            index, _fetched = cls._name_index(api, cache, refresh=True)
+            res = []
+            for item_id in item_ids:
+                try:
+                    res.append(int(item_id))
+                except ValueError:
+                    if is_name_pattern(item_id) and item_id not in index:
+                        matched = index.match(item_id)
+                        if not matched:
+                            raise OktawaveNameNotFound(item_id)
+                        if matches is not None:
+                            matches[item_id] = matched
+                        res.extend(matched_id for matched_id, _name in matched)
+                    else:
+                        res.append(index.lookup(item_id))
+
+        seen = set()
+        return [item_id for item_id in res if not (item_id in seen or seen.add(item_id))]
+
+    @classmethod
+    def names(cls, api, item_ids, cache=None):
+        """Returns the known names of items given by IDs"""
+        index, _fetched = cls._name_index(api, cache)
+        names = (index.name_of(item_id) for item_id in item_ids)
+        return [name for name in names if name is not None]
+
+    @classmethod
+    def _name_index(cls, api, cache=None, refresh=False):
+        """Returns a NameIndex and a flag telling if it was just downloaded"""
+        fetched = []
 
-        found_item_id = None
-        for item_id, item_name in self.list_items(api):
-            if item_name == self.item_id:
-                if found_item_id is not None:
-                    raise OktawaveDuplicateName()
-                found_item_id = item_id
+        def fetch():
+            fetched.append(True)
+            return list(cls.list_items(api))
 
-        if found_item_id is None:
-            raise OktawaveNameNotFound()
+        if cache is None:
+            return NameIndex(fetch()), True
+        index = cache.get(cls.cache_key(api), fetch, NameIndex, refresh=refresh)
+        return index, bool(fetched)
+
+    @classmethod
+    def cache_key(cls, api):
+        return '%s:%s' % (api.username, cls.__name__)
 
-        return found_item_id
+    def as_int(self, api, cache=None):
+        return self.resolve(api, [self.item_id], cache)[0]
 
 
 class OCIid(NamedItemId):
@@ -114,32 +243,353 @@ class ContainerId(NamedItemId):
             yield item['id'], item['name']
 
 
+def parse_time(value):
+    """Parses a point in time given as a local date (and time) or as an age
+
+    Ages are numbers followed by s, m, h, d or w, e.g. "12h" means 12 hours ago.
+    """
+    units = {'s': 1, 'm': 60, 'h': 3600, 'd': 86400, 'w': 604800}
+    if value[-1:] in units and value[:-1].isdigit():
+        return datetime.datetime.now() - datetime.timedelta(seconds=int(value[:-1]) * units[value[-1]])
+    for fmt in ('%Y-%m-%d %H:%M:%S', '%Y-%m-%d %H:%M', '%Y-%m-%dT%H:%M:%S', '%Y-%m-%d'):
+        try:
+            return datetime.datetime.strptime(value, fmt)
+        except ValueError:
+            pass
+    raise argparse.ArgumentTypeError('invalid time: %r' % value)
+
+
+def format_disk_mapping(mapping):
+    if mapping['primary']:
+        tags = 'primary',
+    else:
+        tags = ()
+    if mapping['vm_status'].status == PowerStatus.PowerOn:
+        tags += 'powered on',
+    if tags:
+        tag = ': ' + ', '.join(tags)
+    else:
+        tag = ''
+    return u'{0} ({1}{2})'.format(mapping['id'], mapping['name'], tag)
+
+
+# columns of list commands (see ListQuery); the *_DEFAULT lists are shown without --columns
+# OCI List and OCI ListDetails share their columns, the API methods used
+# depend on the columns (see plan_vm_listing)
+OCI_COLUMNS = [
+    Column('id', 'Virtual machine ID'),
+    Column('name', 'Name'),
+    Column('status', 'Status', aliases=POWER_STATUS_ALIASES),
+    Column('class', 'Class', ('class_name',)),
+    Column('cpu', 'CPU', ('cpu_usage_mhz', 'cpu_mhz'),
+           lambda vm: '%d/%d MHz' % (vm['cpu_usage_mhz'], vm['cpu_mhz'])),
+    Column('memory', 'Memory', ('memory_usage_mb', 'memory_mb'),
+           lambda vm: '%d/%d MB' % (vm['memory_usage_mb'], vm['memory_mb'])),
+    Column('cpu_mhz', 'CPU (MHz)'),
+    Column('cpu_usage_mhz', 'CPU usage (MHz)'),
+    Column('memory_mb', 'Memory (MB)'),
+    Column('memory_usage_mb', 'Memory usage (MB)'),
+    Column('creation_date', 'Created'),
+    Column('creation_user_name', 'Created by'),
+    Column('last_change_date', 'Last changed'),
+    Column('payment_type', 'Payment type'),
+    Column('autoscaling', 'Autoscaling'),
+    Column('connection_type', 'Connection type'),
+    Column('iops_usage', 'IOPS usage'),
+]
+OCI_DEFAULT = ['id', 'name', 'status']
+OCI_DETAILS_DEFAULT = ['id', 'name', 'status', 'class', 'cpu', 'memory']
+
+OVS_COLUMNS = [
+    Column('id', 'ID'),
+    Column('name', 'Name'),
+    Column('tier', 'Tier'),
+    Column('capacity_gb', 'Capacity', display=lambda disk: '%d GB' % disk['capacity_gb']),
+    Column('used_gb', 'Used', display=lambda disk: '%d GB' % disk['used_gb']),
+    Column('shared', 'Shared', ('is_shared',), display=lambda disk: 'Yes' if disk['is_shared'] else 'No'),
+    Column('vms', 'VMs', value=lambda disk: ', '.join(vm['name'] for vm in disk['vms']),
+           display=lambda disk: '\n'.join(format_disk_mapping(vm) for vm in disk['vms'])),
+]
+OVS_DEFAULT = ['id', 'name', 'tier', 'capacity_gb', 'used_gb', 'shared', 'vms']
+
+ORDB_COLUMNS = [
+    Column('id', 'Virtual machine ID'),
+    Column('name', 'Name'),
+    Column('type', 'Type'),
+    Column('size', 'Size'),
+    Column('available_space', 'Available space'),
+]
+ORDB_DEFAULT = ['id', 'name', 'type', 'size', 'available_space']
+
+CONTAINER_COLUMNS = [
+    Column('id', 'Container ID'),
+    Column('name', 'Name'),
+    Column('vms', 'VMs'),
+]
+CONTAINER_DEFAULT = ['id', 'name', 'vms']
+
+OPN_COLUMNS = [
+    Column('id', 'OPN ID'),
+    Column('name', 'Name'),
+    Column('address_pool', 'Address pool'),
+    Column('payment_type', 'Payment type'),
+]
+OPN_DEFAULT = ['id', 'name', 'address_pool', 'payment_type']
+
+
+OCI_TOP_COLUMNS = [
+    Column('id', 'Virtual machine ID'),
+    Column('name', 'Name'),
+    Column('status', 'Status', aliases=POWER_STATUS_ALIASES),
+    number_column('cpu_usage_mhz', 'CPU MHz'),
+    number_column('cpu_mhz', 'CPU max MHz'),
+    number_column('cpu_pct', 'CPU %', ('cpu_usage_mhz', 'cpu_mhz'),
+                  lambda vm: percent(vm['cpu_usage_mhz'], vm['cpu_mhz'])),
+] + gauge_columns('cpu', 'CPU', 'MHz') + [
+    number_column('memory_usage_mb', 'Memory MB'),
+    number_column('memory_mb', 'Memory max MB'),
+    number_column('memory_pct', 'Memory %', ('memory_usage_mb', 'memory_mb'),
+                  lambda vm: percent(vm['memory_usage_mb'], vm['memory_mb'])),
+] + gauge_columns('memory', 'Memory', 'MB')
+OCI_TOP_DEFAULT = [
+    'id', 'name', 'cpu_usage_mhz', 'cpu_pct', 'cpu_delta', 'cpu_rate',
+    'memory_usage_mb', 'memory_pct', 'memory_delta', 'memory_rate']
+
+ORDB_TOP_COLUMNS = [
+    Column('id', 'Virtual machine ID'),
+    Column('name', 'Name'),
+    Column('type', 'Type'),
+    Column('running', 'Running', ('is_running',), display=lambda db: 'Yes' if db['is_running'] else 'No'),
+    number_column('qps', 'QPS'),
+] + gauge_columns('qps', 'QPS', 'QPS') + [
+    number_column('size', 'Size'),
+] + gauge_columns('size', 'Size', 'MB')
+ORDB_TOP_DEFAULT = ['id', 'name', 'qps', 'qps_delta', 'size', 'size_delta', 'size_rate']
+
+
+def waits_for_operations(method):
+    """Marks a command starting asynchronous operations
+
+    Such commands accept --wait (and --timeout): the command then waits
+    for the operations on the objects it touched (see OktawaveCli._track)
+    to finish, reporting their progress. Commands which failed for some
+    objects still wait for the others and then return their failure code.
+    """
+    @wraps(method)
+    def wrapper(self, args):
+        if not getattr(args, 'wait', False) or getattr(args, 'waiting', False):
+            return method(self, args)
+        waiter = OperationWaiter(self.api, timeout=args.timeout, report=self._report_operation)
+        waiter.start()
+        args.waiting = True
+        self._waiter = waiter
+        try:
+            res = method(self, args)
+        finally:
+            args.waiting = False
+            self._waiter = None
+        # a partly failed bulk command still waits for the operations it did start
+        if not waiter.wait():
+            print "ERROR: Timed out waiting for operations to finish"
+            return 1
+        return res
+
+    wrapper.waits_for_operations = True
+    return wrapper
+
+
 class OktawaveCli(object):
     def __init__(self, args, debug=False, output=sys.stdout):
-        self.p = Printer(output)
-        self.api = OktawaveApi(
-            username=args.username, password=args.password,
-            debug=debug)
-        self.ocs = OCSConnection(
-            username=args.ocs_username, password=args.ocs_password)
+        self.p = Printer(output, args.format)
+        self.name_cache = NameCache(ttl=args.name_ttl, persistent=not args.no_disk_cache)
         self.args = args
-        try:
-            self.api._logon(only_common=False)
-        except OktawaveLoginError:
-            print "ERROR: Couldn't login to Oktawave."
-            sys.exit(1)
+        self.debug = debug
+
+    @property
+    def api(self):
+        """Oktawave API, created and logged on to on first use
+
+        Only the CommonService client is set up here, the ClientsService
+        one is created by the first API method which needs it.
+        """
+        if not hasattr(self, '_api'):
+            api = OktawaveApi(
+                username=self.args.username, password=self.args.password,
+                debug=self.debug, session_cache=SessionCache(ttl=self.args.session_ttl),
+                dictionary_cache=DictionaryCache(
+                    ttl=self.args.dictionary_ttl, persistent=not self.args.no_disk_cache),
+                transport=HttpTransport(
+                    pool_size=self.args.pool_size, connect_timeout=self.args.connect_timeout,
+                    read_timeout=self.args.read_timeout),
+                retry_policy=RetryPolicy(
+                    attempts=self.args.api_attempts, pending_timeout=self.args.api_pending_timeout))
+            try:
+                api._logon(only_common=True)
+            except OktawaveLoginError:
+                print "ERROR: Couldn't login to Oktawave."
+                sys.exit(1)
+            self._api = api
+        return self._api
+
+    @property
+    def ocs(self):
+        """OCS connection, created (and swiftclient imported) on first use"""
+        if not hasattr(self, '_ocs'):
+            self._ocs = OCSConnection(
+                username=self.args.ocs_username, password=self.args.ocs_password)
+        return self._ocs
 
     def _print_table(self, head, results, mapper_func):
-        items = map(mapper_func, results)
-        if items:
-            self.p.print_table([head] + items)
-            return True
-        return False
+        return self.p.print_records(head, results, mapper_func)
+
+    def _list_query(self, args, columns, default):
+        """Returns the ListQuery given by --where, --sort, --columns and --limit
+
+        Prints the error and returns None if the options are invalid.
+        """
+        try:
+            return ListQuery(columns, default, args.where, args.sort, args.columns, args.limit)
+        except ListQueryError as e:
+            print "ERROR: " + str(e)
+
+    def _whole_records(self, query):
+        """Tells if whole records are printed (json output without --columns)"""
+        return self.p.format in ('json', 'jsonl') and not query.explicit
+
+    def _print_query(self, query, records):
+        """Prints records filtered, sorted and limited by a query
+
+        Prints the error and returns 1 if --where turns out to be invalid
+        for the records' values.
+        """
+        records = query.apply(records)
+        if self.p.format in ('json', 'jsonl') and query.explicit:
+            records = (query.to_json(record) for record in records)
+        try:
+            self._print_table(query.head(), records, query.row)
+        except ListQueryError as e:
+            print "ERROR: " + str(e)
+            return 1
+
+    def _print_list(self, args, columns, default, list_records):
+        """Prints a listing, applying --where, --sort, --columns and --limit
+
+        list_records(fields) returns the records, with (at least) the given
+        fields filled in, or all of them if fields is None.
+        """
+        query = self._list_query(args, columns, default)
+        if query is None:
+            return 1
+        return self._print_query(query, list_records(None if self._whole_records(query) else query.fields()))
+
+    def _list_vms(self, args, default, record_type):
+        """Lists VMs using the cheapest API methods returning the used columns"""
+        query = self._list_query(args, OCI_COLUMNS, default)
+        if query is None:
+            return 1
+        fields = query.fields()
+        if self._whole_records(query):
+            fields |= set(record_type.__slots__)
+        plan = plan_vm_listing(fields)
+        if args.explain:
+            self._print_table(['API method', 'Calls', 'Fields'], plan.explain(), list)
+            return
+        prefilter = None
+        if plan.details is not None and query.where_fields <= plan.listing.fields:
+            # filter before fetching the details of every VM
+            prefilter = query.predicate
+        return self._print_query(
+            query, self.api.OCI_Select(plan=plan, concurrency=args.concurrency, prefilter=prefilter))
 
     def _name_to_id(self, name_or_id):
         if isinstance(name_or_id, int):
             return name_or_id
-        return name_or_id.as_int(self.api)
+        item_id = name_or_id.as_int(self.api, self.name_cache)
+        self._track(type(name_or_id), [item_id])
+        return item_id
+
+    def _track(self, id_type=None, item_ids=(), names=()):
+        """Tells the waiter of a command run with --wait which objects it touched
+
+        Operations are matched by object ID and name, so the names of
+        items given by ID are looked up (in the name cache) as well.
+        """
+        waiter = getattr(self, '_waiter', None)
+        if waiter is None:
+            return
+        names = list(names)
+        if id_type is not None and item_ids:
+            names.extend(id_type.names(self.api, item_ids, self.name_cache))
+        waiter.track(item_ids, names)
+
+    def _bulk_ids(self, args, id_type, matches=None):
+        """Returns IDs of all items given by IDs, names, patterns or --from-file
+
+        Expanded patterns are stored in matches, see NamedItemId.expand().
+        """
+        items = [item.item_id for item in args.id]
+        if args.from_file:
+            fh = sys.stdin if args.from_file == '-' else open(args.from_file)
+            try:
+                for line in fh:
+                    line = line.strip()
+                    if line and not line.startswith('#'):
+                        items.append(line)
+            finally:
+                if fh is not sys.stdin:
+                    fh.close()
+        return id_type.expand(self.api, items, self.name_cache, matches)
+
+    def _bulk_vm_method(self, args, id_type, method, confirm=None):
+        """Calls method(oci_id) concurrently for every VM given in args
+
+        Prints a per-VM summary and returns 1 if any of the calls failed.
+        If confirm (a verb, like "Delete") is given and a name pattern
+        matched more than one VM, the matched VMs are listed and nothing
+        is done unless --yes was given or the user confirms.
+        """
+        matches = {}
+        oci_ids = self._bulk_ids(args, id_type, matches)
+        if not oci_ids:
+            print "ERROR: No virtual machines given"
+            return 1
+        if confirm and not args.yes and any(len(matched) > 1 for matched in matches.itervalues()):
+            if not self._confirm_matches(confirm, matches, len(oci_ids), interactive=args.from_file != '-'):
+                return 1
+        self.api._logon()
+        results = run_parallel(method, oci_ids, args.concurrency)
+
+        def fmt(result):
+            oci_id, _res, error = result
+            return [oci_id, 'OK' if error is None else 'ERROR: ' + str(error)]
+
+        self._track(id_type, [oci_id for oci_id, _res, error in results if error is None])
+        self._print_table(['Virtual machine ID', 'Result'], results, fmt)
+        if any(error is not None for _oci_id, _res, error in results):
+            return 1
+
+    def _confirm_matches(self, verb, matches, count, interactive=True):
+        """Lists the items matched by name patterns and asks whether to go on"""
+        for pattern, matched in sorted(matches.iteritems()):
+            print '"%s" matches %d virtual machines:' % (pattern, len(matched))
+            for item_id, name in matched:
+                print '  %s (%s)' % (name, item_id)
+        if not interactive or not sys.stdin.isatty():
+            print "ERROR: Not confirmed, use --yes to %s them" % verb.lower()
+            return False
+        answer = raw_input('%s %d virtual machines? [y/N] ' % (verb, count))
+        return answer.strip().lower() in ('y', 'yes')
+
+    def _report_operation(self, op, finished):
+        if finished:
+            print '%(object_type)s %(object_name)s: %(type)s finished' % op
+        else:
+            print '%(object_type)s %(object_name)s: %(type)s %(progress_percent)d%%' % op
+
+    def _names_changed(self, *id_types):
+        """Drops cached name indexes after resources were created, renamed or deleted"""
+        for id_type in id_types:
+            self.name_cache.invalidate(id_type.cache_key(self.api))
 
     def Account_Settings(self, args):
         res = self.api.Account_Settings()
@@ -151,7 +601,7 @@ class OktawaveCli(object):
             ['Availability zone', res['availability_zone']],
             ['24h clock', 'Yes' if res['24h_clock'] else 'No']
         ]
-        self.p._print("Account settings:")
+        self.p.section("Account settings:")
         self.p.print_table(tab)
 
     def Account_RunningJobs(self, args):
@@ -171,7 +621,14 @@ class OktawaveCli(object):
         if not self._print_table(
                 ['Operation ID', 'Started at', 'Started by', 'Operation type', 'Object', 'Progress', 'Status'],
                 ops, fmt):
-            print "No running operations"
+            self.p.notice("No running operations")
+
+    def Account_RefreshCache(self, args):
+        """Refreshes cached dictionaries and drops cached names"""
+        res = self.api.Account_RefreshCache()
+        self.name_cache.invalidate()
+        self._print_table(
+            ['Dictionary ID', 'Items'], sorted(res.items()), list)
 
     def Account_Users(self, args):
         """Print users in client account."""
@@ -188,6 +645,55 @@ class OktawaveCli(object):
             ['Client ID', 'E-mail', 'Name'],
             users, fmt)
 
+    def _inventory_path(self, args):
+        return args.database or Inventory.default_path(self.args.username)
+
+    def Account_Snapshot(self, args):
+        """Saves all resources of the account to a local SQLite database"""
+        inventory = Inventory(self._inventory_path(args))
+        try:
+            if args.refresh:
+                max_age = DEFAULT_DETAILS_MAX_AGE if args.max_age is None else args.max_age
+                changes = inventory.refresh(self.api, args.concurrency, max_age)
+            else:
+                changes = inventory.snapshot(self.api, args.concurrency)
+            counts = inventory.counts()
+            if args.changes_since is not None:
+                changes = inventory.changes(args.changes_since)
+        finally:
+            inventory.close()
+        with self.p.sections():
+            self.p.section('Tables')
+            self._print_table(['Table', 'Rows'], [[table, counts[table]] for table in TABLES], list)
+            self.p.section('Changes')
+            if not self._print_table(['Time', 'Type', 'ID', 'Name', 'Change'], changes, list):
+                self.p.notice("No changes")
+
+    def Account_Query(self, args):
+        """Queries the database saved by Account Snapshot"""
+        path = self._inventory_path(args)
+        if not os.path.exists(os.path.expanduser(path)):
+            print "ERROR: No snapshot in %s, run Account Snapshot first" % path
+            return 1
+        inventory = Inventory(path)
+        try:
+            if args.sql is None:
+                self._print_table(
+                    ['Table', 'Columns'],
+                    [[table, ', '.join(inventory.columns(table))] for table in TABLES], list)
+                return
+            try:
+                head, rows = inventory.query(args.sql)
+                if not head:
+                    return
+                self.p.print_table([head] + list(rows))
+            except (sqlite3.Error, sqlite3.Warning) as e:
+                # Warning is not an Error in python 2, e.g. for several statements at once
+                print "ERROR: " + str(e)
+                return 1
+        finally:
+            inventory.close()
+
     def Template_Show(self, args):
         """Shows more detailed info about a particular template"""
         ti = self.api.Template_Show(args.id)
@@ -215,7 +721,7 @@ class OktawaveCli(object):
         self.p.print_table(tab)
 
     def _print_templates(self, templates):
-        if templates:
+        if templates or self.p.format != 'table':
             tab = [['ID', 'Name', 'Category', 'System category']]
             tab.extend([
                 [t['id'], t['name'], t['category'], t['system_category']]
@@ -237,50 +743,76 @@ class OktawaveCli(object):
 
     def OCI_List(self, args):
         """Lists client's virtual machines"""
-        vms = self.api.OCI_List()
-
-        def fmt(vm):
-            return [vm['id'], vm['name'], vm['status']]
-
-        self._print_table(
-            ['Virtual machine ID', 'Name', 'Status'], vms, fmt)
+        return self._list_vms(args, OCI_DEFAULT, VmSummary)
 
     def OCI_ListDetails(self, args):
         """Lists client's virtual machines"""
-        vms = self.api.OCI_ListDetails()
-
-        def fmt(vm):
-            return [vm['id'], vm['name'], vm['status'], vm['class_name'],
-                    '%d/%d MHz' % (vm['cpu_usage_mhz'], vm['cpu_mhz']),
-                    '%d/%d MB' % (vm['memory_usage_mb'], vm['memory_mb'])]
+        return self._list_vms(args, OCI_DETAILS_DEFAULT, VmDetails)
+
+    def _top(self, args, title, sampler, columns, default, sort):
+        """Shows samples of a listing every --interval seconds
+
+        Uses a full-screen view on terminals, and prints the samples one
+        after another with --batch, other output formats or when the
+        output is not a terminal.
+        """
+        if args.sort is None:
+            args.sort = sort
+        query = self._list_query(args, columns, default)
+        if query is None:
+            return 1
+        self.api  # log on once, all samples use the same session
+        try:
+            if args.batch or self.p.format != 'table' or not sys.stdout.isatty():
+                samples = 0
+                while True:
+                    if self._print_query(query, sampler.sample()):
+                        return 1
+                    samples += 1
+                    if args.count is not None and samples >= args.count:
+                        return
+                    time.sleep(args.interval)
+            TopScreen(title, sampler, query, args.interval, args.count).run()
+        except ListQueryError as e:
+            print "ERROR: " + str(e)
+            return 1
+        except KeyboardInterrupt:
+            pass
 
-        self._print_table(
-            ['Virtual machine ID', 'Name', 'Status', 'Class', 'CPU', 'Memory'], vms, fmt)
+    def OCI_Top(self, args):
+        """Shows CPU and memory usage of virtual machines, refreshed periodically"""
+        fields = set(['id', 'name', 'status', 'cpu_mhz', 'cpu_usage_mhz', 'memory_mb', 'memory_usage_mb'])
+        sampler = Sampler(
+            lambda: self.api.OCI_ListDetails(fields=fields), lambda vm: vm['id'],
+            [('cpu_usage_mhz', 'cpu'), ('memory_usage_mb', 'memory')])
+        return self._top(args, 'OCI Top', sampler, OCI_TOP_COLUMNS, OCI_TOP_DEFAULT, '-cpu_usage_mhz')
 
+    @waits_for_operations
     def OCI_Restart(self, args):
-        """Restarts given VM"""
-        oci_id = self._name_to_id(args.id)
-        self.api.OCI_Restart(oci_id)
+        """Restarts given VMs"""
+        return self._bulk_vm_method(args, OCIid, self.api.OCI_Restart)
 
+    @waits_for_operations
     def OCI_TurnOff(self, args):
-        """Turns given VM off"""
-        oci_id = self._name_to_id(args.id)
-        self.api.OCI_TurnOff(oci_id)
+        """Turns given VMs off"""
+        return self._bulk_vm_method(args, OCIid, self.api.OCI_TurnOff)
 
+    @waits_for_operations
     def OCI_TurnOn(self, args):
-        """Turns given virtual machine on"""
-        oci_id = self._name_to_id(args.id)
-        self.api.OCI_TurnOn(oci_id)
+        """Turns given virtual machines on"""
+        return self._bulk_vm_method(args, OCIid, self.api.OCI_TurnOn)
 
+    @waits_for_operations
     def OCI_Delete(self, args):
-        """Deletes given virtual machine"""
-        oci_id = self._name_to_id(args.id)
-        self.api.OCI_Delete(oci_id)
+        """Deletes given virtual machines"""
+        res = self._bulk_vm_method(args, OCIid, self.api.OCI_Delete, confirm='Delete')
+        self._names_changed(OCIid, ORDBid)
+        return res
 
     def OCI_Logs(self, args):
         """Shows virtual machine logs"""
         oci_id = self._name_to_id(args.id)
-        logs = self.api.OCI_Logs(oci_id)
+        logs = self.api.OCI_Logs(oci_id, since=args.since, until=args.until, types=args.types)
 
         def fmt(op):
             return [
@@ -317,9 +849,6 @@ class OktawaveCli(object):
             ['Name', settings['name']],
             ['Class', settings['vm_class_name']]
         ])
-        self.p._print('Basic VM settings and statistics')
-        self.p.print_table(base_tab)
-
         def fmt_disk(disk):
             return [
                 disk['id'],
@@ -331,11 +860,6 @@ class OktawaveCli(object):
                 'Yes' if disk['is_shared'] else 'No'
             ]
 
-        self.p._print("Hard disks")
-        self._print_table(
-            ['ID', 'Name', 'Capacity (GB)', 'Created at', 'Created by', 'Primary', 'Shared'],
-            settings['disks'], fmt_disk)
-
         def fmt_ip(ip):
             return [
                 ip['ipv4'] + '/' + ip['netmask'],
@@ -348,52 +872,68 @@ class OktawaveCli(object):
                 ip['macaddr']
             ]
 
-        self.p._print("IP addresses")
-        self._print_table([
-                              'IPv4 address',
-                              'IPv6 address',
-                              'Created at',
-                              'DHCP branch',
-                              'Gateway',
-                              'Status',
-                              'Last changed',
-                              'MAC address'
-                          ], settings['ips'], fmt_ip)
-
-        if settings['vlans']:
-            self.p._print("Private vlans")
-
-            def fmt_vlan(vlan):
-                return [
-                    vlan['ipv4'],
-                    vlan['creation_date'],
-                    vlan['macaddr'],
-                ]
+        def fmt_vlan(vlan):
+            return [
+                vlan['ipv4'],
+                vlan['creation_date'],
+                vlan['macaddr'],
+            ]
 
-            self._print_table(
-                ['IPv4 address', 'Created at', 'MAC address'],
-                settings['vlans'], fmt_vlan)
+        with self.p.sections():
+            self.p.section('Basic VM settings and statistics')
+            self.p.print_table(base_tab)
 
+            self.p.section("Hard disks")
+            self._print_table(
+                ['ID', 'Name', 'Capacity (GB)', 'Created at', 'Created by', 'Primary', 'Shared'],
+                settings['disks'], fmt_disk)
+
+            self.p.section("IP addresses")
+            self._print_table([
+                                  'IPv4 address',
+                                  'IPv6 address',
+                                  'Created at',
+                                  'DHCP branch',
+                                  'Gateway',
+                                  'Status',
+                                  'Last changed',
+                                  'MAC address'
+                              ], settings['ips'], fmt_ip)
+
+            if settings['vlans']:
+                self.p.section("Private vlans")
+                self._print_table(
+                    ['IPv4 address', 'Created at', 'MAC address'],
+                    settings['vlans'], fmt_vlan)
+
+    @waits_for_operations
     def OCI_Create(self, args, forced_type='Machine', db_type=None):
         """Creates a new instance from template"""
         forced_type = getattr(TemplateType, forced_type)
         if not args.oci_class:
             args.oci_class = None
+        self._track(names=[args.name])
         try:
             self.api.OCI_Create(args.name, args.template, args.oci_class, forced_type, db_type, args.subregion)
         except OktawaveOCIClassNotFound:
             print "OCI class not found"
+        else:
+            self._names_changed(OCIid, ORDBid)
 
+    @waits_for_operations
     def OCI_ChangeClass(self, args):
         """Changes running VM class"""
         oci_id = self._name_to_id(args.id)
         self.api.OCI_ChangeClass(oci_id, args.oci_class)
 
+    @waits_for_operations
     def OCI_Clone(self, args):
         """Clones a VM"""
         oci_id = self._name_to_id(args.id)
         clonetype = getattr(CloneType, args.clonetype)
+        self._track(names=[args.name])
         self.api.OCI_Clone(oci_id, args.name, clonetype)
+        self._names_changed(OCIid, ORDBid)
 
     def _oci_ip(self, oci_id):
         settings = self.api.OCI_Settings(oci_id)
@@ -435,37 +975,6 @@ class OktawaveCli(object):
             return 'object'
         return data['content_type']
 
-    def _list_swift_objects(self, container, cname, path=None):
-        if path is None:
-            path = ''
-        elif not path.endswith('/'):
-            path += '/'
-        container = container[1]
-
-        if path:
-            for d in container:
-                if d['content_type'] == 'application/directory' and d['name'] + '/' == path:
-                    print 'Directory content:'
-                    break
-            else:
-                print "No such container/directory!"
-                return
-        else:
-            print 'Container content:'
-
-        def fmt_file(swift_obj):
-            return [
-                cname + '/' + swift_obj['name'],
-                self._swift_object_type(swift_obj),
-                swift_obj['bytes'],
-                swift_obj['last_modified'],
-            ]
-
-        self._print_table(
-            ['Full path', 'Type', 'Size in bytes', 'Last modified'],
-            sorted([o for o in container if o['name'].startswith(path)], key=lambda row: row['name']),
-            fmt_file)
-
     def _print_swift_file(self, data):
         headers, content = data
         ctype = headers['content-type']
@@ -502,16 +1011,62 @@ class OktawaveCli(object):
                     '3 Size in bytes': [headers['x-container-bytes-used']],
                 },
                 order=True)
+        elif args.output:
+            download = RangedDownload(
+                self.ocs, container, path, args.output,
+                chunk_size=args.chunk_size * MB, concurrency=args.concurrency, retries=args.retries)
+            downloaded, skipped = download.run()
+            print "OK (%d parts downloaded, %d already present)" % (downloaded, skipped)
         else:
             self._print_swift_file(
                 self.ocs.get_object(container, path))
 
     def OCS_List(self, args):
-        """Lists content of a directory or container"""
+        """Lists content of a directory or container
+
+        Objects are listed page by page and printed as they arrive.
+        """
         container, path = self._ocs_split_params(args)
-        obj = self.ocs.get_container(
-            container)  # TODO: perhaps we can optimize it not to download the whole container when not necessary
-        self._list_swift_objects(obj, container, path)
+        prefix = None
+        if path:
+            prefix = path if path.endswith('/') else path + '/'
+        objects = list_objects(
+            self.ocs, container, prefix=prefix,
+            delimiter=None if args.recursive else '/', limit=args.limit)
+
+        if args.count:
+            print sum(1 for _obj in objects)
+            return
+
+        try:
+            first = next(objects)
+        except StopIteration:
+            if prefix:
+                print "No such container/directory!"
+            else:
+                print 'Container is empty'
+            return
+        print 'Directory content:' if prefix else 'Container content:'
+
+        def rows():
+            last_dir = None
+            for swift_obj in chain([first], objects):
+                if 'subdir' in swift_obj:
+                    # skip pseudo-directories already listed as directory objects
+                    if swift_obj['subdir'] != last_dir:
+                        yield [container + '/' + swift_obj['subdir'], 'directory', '', '']
+                    continue
+                obj_type = self._swift_object_type(swift_obj)
+                if obj_type == 'directory':
+                    last_dir = swift_obj['name'] + '/'
+                yield [
+                    container + '/' + swift_obj['name'],
+                    obj_type,
+                    swift_obj['bytes'],
+                    swift_obj['last_modified'],
+                ]
+
+        self.p.print_rows(['Full path', 'Type', 'Size in bytes', 'Last modified'], rows())
 
     def OCS_CreateContainer(self, args):
         """Creates a new container"""
@@ -526,11 +1081,52 @@ class OktawaveCli(object):
         print "OK"
 
     def OCS_Put(self, args):
-        """Uploads a file to the server"""
+        """Uploads a file to the server
+
+        Files larger than the segment size are uploaded as concurrently
+        uploaded segments and a large object manifest.
+        """
         container, path = self._ocs_split_params(args)
-        fh = open(args.local_path, 'r')
-        self.ocs.put_object(container, path, fh)
-        print "OK"
+        if path is None:
+            path = os.path.basename(args.local_path)
+        segment_size = args.segment_size * MB
+        if os.path.getsize(args.local_path) <= segment_size:
+            with open(args.local_path, 'rb') as fh:
+                self.ocs.put_object(container, path, fh)
+            print "OK"
+            return
+
+        upload = SegmentedUpload(
+            self.ocs, args.local_path, container, path,
+            segment_size=segment_size, concurrency=args.concurrency,
+            manifest=args.manifest, retries=args.retries)
+        uploaded, skipped = upload.run()
+        print "OK (%d segments uploaded, %d already present)" % (uploaded, skipped)
+
+    def OCS_Sync(self, args):
+        """Synchronises a local directory with a container or a directory within it"""
+        container, path = self._ocs_split_params(args)
+        if not os.path.isdir(args.local_dir):
+            print "ERROR: %s is not a directory" % args.local_dir
+            return 1
+        if args.dry_run:
+            print "Dry run, nothing will be changed"
+
+        def report(action, name):
+            print '%s %s' % (action, name)
+
+        sync = DirectorySync(
+            self.ocs, args.local_dir, container, path or '',
+            download=args.download, delete=args.delete, dry_run=args.dry_run,
+            concurrency=args.concurrency, segment_size=args.segment_size * MB,
+            retries=args.retries, report=report)
+        transferred, deleted, unchanged, errors = sync.run()
+        for name, error in errors:
+            print "ERROR: %s: %s" % (name, error)
+        print "%d transferred, %d deleted, %d unchanged, %d failed" % (
+            transferred - len(errors), deleted, unchanged, len(errors))
+        if errors:
+            return 1
 
     def OCS_Delete(self, args):
         """Deletes an object from a container"""
@@ -546,38 +1142,10 @@ class OktawaveCli(object):
 
     def OVS_List(self, args):
         """Lists disks"""
-        disks = self.api.OVS_List()
-
-        def fmt_mapping(mapping):
-            ovs_id = mapping['id']
-            name = mapping['name']
-            if mapping['primary']:
-                tags = 'primary',
-            else:
-                tags = ()
-            if mapping['vm_status'].status == PowerStatus.PowerOn:
-                tags += 'powered on',
-            if tags:
-                tag = ': ' + ', '.join(tags)
-            else:
-                tag = ''
-            return u'{0} ({1}{2})'.format(ovs_id, name, tag)
-
-        def fmt(disk):
-            return [
-                disk['id'],
-                disk['name'],
-                disk['tier'],
-                '%d GB' % disk['capacity_gb'],
-                '%d GB' % disk['used_gb'],
-                'Yes' if disk['is_shared'] else 'No',
-                '\n'.join(fmt_mapping(vm) for vm in disk['vms']) if disk['vms'] else ''
-            ]
-
-        self._print_table(
-            ['ID', 'Name', 'Tier', 'Capacity', 'Used', 'Shared', 'VMs'],
-            disks, fmt)
+        return self._print_list(
+            args, OVS_COLUMNS, OVS_DEFAULT, lambda fields: self.api.OVS_List(fields=fields))
 
+    @waits_for_operations
     def OVS_Delete(self, args):
         """Deletes a disk"""
         ovs_id = self._name_to_id(args.id)
@@ -586,13 +1154,18 @@ class OktawaveCli(object):
         except OktawaveOVSDeleteError:
             print "ERROR: Disk cannot be deleted (is it mapped to any OCI instances?)."
         else:
+            self._names_changed(OVSid)
             print "OK"
 
+    @waits_for_operations
     def OVS_Create(self, args):
         """Adds a disk"""
+        self._track(names=[args.name])
         self.api.OVS_Create(args.name, args.capacity, args.tier, (args.disktype == 'shared'), args.subregion)
+        self._names_changed(OVSid)
         print "OK"
 
+    @waits_for_operations
     def OVS_Map(self, args):
         """Maps a disk into an instance"""
         ovs_id = self._name_to_id(args.id)
@@ -607,6 +1180,7 @@ class OktawaveCli(object):
         else:
             print "OK"
 
+    @waits_for_operations
     def OVS_Unmap(self, args):
         """Unmaps a disk from an instance"""
         ovs_id = self._name_to_id(args.id)
@@ -621,12 +1195,14 @@ class OktawaveCli(object):
         else:
             print "OK"
 
+    @waits_for_operations
     def OVS_ChangeTier(self, args):
         """Changes OVS tier"""
         ovs_id = self._name_to_id(args.id)
         self.api.OVS_ChangeTier(ovs_id, args.tier)
         print "OK"
 
+    @waits_for_operations
     def OVS_Extend(self, args):
         """Resizes OVS volume"""
         ovs_id = self._name_to_id(args.id)
@@ -643,44 +1219,36 @@ class OktawaveCli(object):
 
     def ORDB_List(self, args):
         """Lists databases"""
-        dbs = self.api.ORDB_List()
-
-        def fmt(db):
-            return [
-                db['id'],
-                db['name'],
-                db['type'],
-                db['size'],
-                db['available_space']
-            ]
-
-        self._print_table(
-            ['Virtual machine ID', 'Name', 'Type', 'Size', 'Available space'],
-            dbs, fmt)
+        return self._print_list(
+            args, ORDB_COLUMNS, ORDB_DEFAULT, lambda fields: self.api.ORDB_List(fields=fields))
 
+    @waits_for_operations
     def ORDB_TurnOn(self, args):
-        """Turns a database on"""
-        oci_id = self._name_to_id(args.id)
-        self.api.ORDB_TurnOn(oci_id)
+        """Turns databases on"""
+        return self._bulk_vm_method(args, ORDBid, self.api.ORDB_TurnOn)
 
+    @waits_for_operations
     def ORDB_TurnOff(self, args):
-        """Turns a database off"""
-        oci_id = self._name_to_id(args.id)
-        self.api.ORDB_TurnOff(oci_id)
+        """Turns databases off"""
+        return self._bulk_vm_method(args, ORDBid, self.api.ORDB_TurnOff)
 
+    @waits_for_operations
     def ORDB_Restart(self, args):
-        """Restarts a database"""
-        oci_id = self._name_to_id(args.id)
-        self.api.ORDB_Restart(oci_id)
+        """Restarts databases"""
+        return self._bulk_vm_method(args, ORDBid, self.api.ORDB_Restart)
 
+    @waits_for_operations
     def ORDB_Clone(self, args):
         """Clones a database VM"""
         self.OCI_Clone(args)
 
+    @waits_for_operations
     def ORDB_Delete(self, args):
         """Deletes a database or VM"""
         oci_id = self._name_to_id(args.id)
         self.api.ORDB_Delete(oci_id, args.db_name)
+        if args.db_name is None:
+            self._names_changed(OCIid, ORDBid)
 
     def ORDB_Logs(self, args):
         """Shows database VM logs"""
@@ -698,25 +1266,35 @@ class OktawaveCli(object):
                 db['type'],
                 db['encoding'],
                 'Yes' if db['is_running'] else 'No',
-                db['QPS'],
-                db['Size']
+                db['qps'],
+                db['size']
             ]
 
         self._print_table(
             ['Virtual machine ID', 'Name', 'Type', 'Encoding', 'Running', 'QPS', 'Size'],
             dbs, fmt)
 
+    def ORDB_Top(self, args):
+        """Shows queries per second and sizes of logical databases, refreshed periodically"""
+        sampler = Sampler(
+            lambda: self.api.ORDB_LogicalDatabases(None), lambda db: (db['id'], db['name']),
+            [('qps', 'qps'), ('size', 'size')])
+        return self._top(args, 'ORDB Top', sampler, ORDB_TOP_COLUMNS, ORDB_TOP_DEFAULT, '-qps')
+
     def ORDB_Settings(self, args):
         """Shows database VM settings"""
         self.OCI_Settings(args)
 
+    @waits_for_operations
     def ORDB_Create(self, args):
         """Creates a database VM"""
+        self._track(names=[args.name])
         try:
             self.api.ORDB_Create(args.name, args.template, oci_class=args.oci_class, subregion=args.subregion)
         except OktawaveORDBInvalidTemplateError:
             print "ERROR: Selected template is not a database template"
             return 1
+        self._names_changed(OCIid, ORDBid)
 
     def ORDB_GlobalSettings(self, args):
         """Shows global database engine settings"""
@@ -730,27 +1308,31 @@ class OktawaveCli(object):
 
     def ORDB_Templates(self, args):
         """Lists database VM templates"""
-        print "\nCategory: MySQL"
-        self._print_templates(self.api.templates_in_category(OktawaveConstants['MYSQL_TEMPLATE_CATEGORY']))
-        print "Category: PostgreSQL"
-        self._print_templates(self.api.templates_in_category(OktawaveConstants['POSTGRESQL_TEMPLATE_CATEGORY']))
+        with self.p.sections():
+            self.p.section("\nCategory: MySQL")
+            self._print_templates(self.api.templates_in_category(OktawaveConstants['MYSQL_TEMPLATE_CATEGORY']))
+            self.p.section("Category: PostgreSQL")
+            self._print_templates(self.api.templates_in_category(OktawaveConstants['POSTGRESQL_TEMPLATE_CATEGORY']))
 
     def ORDB_TemplateInfo(self, args):
         """Shows information about a template"""
         self.Template_Show(args)
 
+    @waits_for_operations
     def ORDB_CreateLogicalDatabase(self, args):
         """Creates a new logical database within an instance"""
         oci_id = self._name_to_id(args.id)
         self.api.ORDB_CreateLogicalDatabase(oci_id, args.name, args.encoding)
         print "OK"
 
+    @waits_for_operations
     def ORDB_BackupLogicalDatabase(self, args):
         """Creates a backup of logical database"""
         oci_id = self._name_to_id(args.id)
         self.api.ORDB_BackupLogicalDatabase(oci_id, args.name)
         print "OK"
 
+    @waits_for_operations
     def ORDB_MoveLogicalDatabase(self, args):
         """Moves a logical database"""
         oci_id_from = self._name_to_id(args.id_from)
@@ -769,6 +1351,7 @@ class OktawaveCli(object):
             ['File name', 'Database type', 'Full path'],
             backups, fmt)
 
+    @waits_for_operations
     def ORDB_RestoreLogicalDatabase(self, args):
         """Restores a database from backup"""
         oci_id = self._name_to_id(args.id)
@@ -777,13 +1360,8 @@ class OktawaveCli(object):
 
     def Container_List(self, args):
         """Lists client's containers"""
-        containers = self.api.Container_List()
-
-        def fmt(c):
-            return [c['id'], c['name'], c['vms']]
-
-        self._print_table(
-            ['Container ID', 'Name', 'VMs'], containers, fmt)
+        return self._print_list(
+            args, CONTAINER_COLUMNS, CONTAINER_DEFAULT, lambda fields: self.api.Container_List(fields=fields))
 
     def Container_Get(self, args):
         """Displays a container's information"""
@@ -820,18 +1398,19 @@ class OktawaveCli(object):
             base_tab.extend([['Database user', c['db_user']]])
         if c['db_password'] is not None:
             base_tab.extend([['Database password', c['db_password']]])
-        self.p._print('\nBasic container settings')
-        self.p.print_table(base_tab)
-
         oci_list = self.api.Container_OCIList(container_id)
 
         def fmt_oci(oci):
             return [oci['oci_id'], oci['oci_name'], oci['status']]
 
-        self.p._print('\nAttached OCIs')
-        self._print_table(
-            ['ID', 'Name', 'Status'], oci_list, fmt_oci)
+        with self.p.sections():
+            self.p.section('\nBasic container settings')
+            self.p.print_table(base_tab)
+            self.p.section('\nAttached OCIs')
+            self._print_table(
+                ['ID', 'Name', 'Status'], oci_list, fmt_oci)
 
+    @waits_for_operations
     def Container_RemoveOCI(self, args):
         """Removes an OCI from a container"""
         container_id = self._name_to_id(args.id)
@@ -839,6 +1418,7 @@ class OktawaveCli(object):
         self.api.Container_RemoveOCI(container_id, oci_id)
         print "OK"
 
+    @waits_for_operations
     def Container_AddOCI(self, args):
         """Adds an OCI to a container"""
         container_id = self._name_to_id(args.id)
@@ -846,22 +1426,28 @@ class OktawaveCli(object):
         self.api.Container_AddOCI(container_id, oci_id)
         print "OK"
 
+    @waits_for_operations
     def Container_Delete(self, args):
         """Deletes a container"""
         container_id = self._name_to_id(args.id)
         self.api.Container_Delete(container_id)
+        self._names_changed(ContainerId)
         print "OK"
 
+    @waits_for_operations
     def Container_Create(self, args):
         """Creates a new container"""
         self.api._d(args)
+        self._track(names=[args.name])
         container_id = self.api.Container_Create(
             args.name, args.load_balancer, args.service, args.port, args.proxy_cache,
             args.use_ssl, args.healthcheck, args.mysql_master_id, args.session_persistence,
             args.load_balancer_algorithm, args.ip_version, args.autoscaling
         )
+        self._names_changed(ContainerId)
         print "OK, new container ID: " + str(container_id) + "."
 
+    @waits_for_operations
     def Container_Edit(self, args):
         """Modifies a container."""
         self.api._d(args)
@@ -871,17 +1457,13 @@ class OktawaveCli(object):
             args.use_ssl, args.healthcheck, args.mysql_master_id, args.session_persistence,
             args.load_balancer_algorithm, args.ip_version, args.autoscaling
         )
+        self._names_changed(ContainerId)
         print "OK"
 
     def OPN_List(self, args):
         """Lists client's private networks"""
-        vlans = self.api.OPN_List()
-
-        def fmt(c):
-            return [c['id'], c['name'], c['address_pool'], c['payment_type']]
-
-        self._print_table(
-            ['OPN ID', 'Name', 'Address pool', 'Payment type'], vlans, fmt)
+        return self._print_list(
+            args, OPN_COLUMNS, OPN_DEFAULT, lambda fields: self.api.OPN_List(fields=fields))
 
     def OPN_Get(self, args):
         """Displays an OPN"""
@@ -895,8 +1477,6 @@ class OktawaveCli(object):
             ['Address pool', c['address_pool']],
             ['Payment type', c['payment_type']]
         ])
-        self.p._print('\nBasic OPN settings')
-        self.p.print_table(base_tab)
         vm_tab = [['OCI ID', 'Name', 'MAC address', 'Private IP address']]
         vm_tab.extend([[
             vm['VirtualMachine']['VirtualMachineId'],
@@ -904,14 +1484,21 @@ class OktawaveCli(object):
             vm['MacAddress'],
             vm['PrivateIpAddress']
         ] for vm in c['vms']])
-        self.p._print('Virtual machines')
-        self.p.print_table(vm_tab)
+        with self.p.sections():
+            self.p.section('\nBasic OPN settings')
+            self.p.print_table(base_tab)
+            self.p.section('Virtual machines')
+            self.p.print_table(vm_tab)
 
+    @waits_for_operations
     def OPN_Create(self, args):
         """Creates a new OPN"""
+        self._track(names=[args.name])
         self.api.OPN_Create(args.name, args.address_pool)
+        self._names_changed(OPNid)
         print "OK"
 
+    @waits_for_operations
     def OPN_AddOCI(self, args):
         """Adds an OCI to an OPN"""
         opn_id = self._name_to_id(args.id)
@@ -919,6 +1506,7 @@ class OktawaveCli(object):
         self.api.OPN_AddOCI(opn_id, oci_id, args.ip_address)
         print "OK"
 
+    @waits_for_operations
     def OPN_RemoveOCI(self, args):
         """Removes an OCI from an OPN"""
         opn_id = self._name_to_id(args.id)
@@ -926,15 +1514,18 @@ class OktawaveCli(object):
         self.api.OPN_RemoveOCI(opn_id, oci_id)
         print "OK"
 
+    @waits_for_operations
     def OPN_Delete(self, args):
         """Deletes a private network."""
         opn_id = self._name_to_id(args.id)
         self.api.OPN_Delete(opn_id)
+        self._names_changed(OPNid)
         print "OK"
 
     def OPN_Rename(self, args):
         """Changes an OPN's name"""
         opn_id = self._name_to_id(args.id)
         self.api.OPN_Rename(opn_id, args.name)
+        self._names_changed(OPNid)
         print "OK"
 
@@ -1,10 +1,14 @@
 import json
 import datetime
 import pprint
+from decimal import Decimal
+from importlib import import_module
+import random
+import threading
+from time import time, sleep
 
-import requests
-
-from oktawave.exceptions import OktawaveAPIError, OktawaveAccessDenied, OktawaveFault
+from oktawave.exceptions import OktawaveAPIError, OktawaveAccessDenied, OktawaveFault, OktawaveAPIUnavailable
+from oktawave.parallel import in_background
 
 
 def raise_api_error(fault_text):
@@ -31,20 +35,389 @@ def raise_api_error(fault_text):
         raise OktawaveFault(error_msg.text)
 
 
+_ijson_backend = None
+
+
+def ijson_backend():
+    """Returns the fastest installed ijson backend, or None if ijson is not installed"""
+    global _ijson_backend
+    if _ijson_backend is None:
+        _ijson_backend = False
+        for name in ('yajl2_c', 'yajl2_cffi', 'yajl2', 'python'):
+            try:
+                _ijson_backend = import_module('ijson.backends.' + name)
+                break
+            except ImportError:
+                pass
+    return _ijson_backend or None
+
+
+def iter_results(fileobj, backend, key='_results'):
+    """Yields elements of the key array of a (possibly wrapped) JSON response
+
+    The response is decoded incrementally with an ijson backend, so only
+    a single element is held in memory at a time.
+    """
+    from ijson.common import ObjectBuilder
+
+    events = backend.parse(fileobj)
+    for prefix, event, value in events:
+        path = prefix.split('.')
+        if path[-2:] != [key, 'item'] or len(path) > 3:
+            continue
+        if event not in ('start_map', 'start_array'):
+            yield _number(value)
+            continue
+        item_prefix = prefix
+        end_event = event.replace('start', 'end')
+        builder = ObjectBuilder()
+        while (prefix, event) != (item_prefix, end_event):
+            builder.event(event, _number(value))
+            prefix, event, value = next(events)
+        yield builder.value
+
+
+def _number(value):
+    # ijson decodes non-integral numbers as Decimal, json as float
+    if isinstance(value, Decimal):
+        return float(value)
+    return value
+
+
+class RetryPolicy(object):
+    """Decides which failed API calls are retried and how long to wait before that
+
+    Read-only methods are retried on transient failures: network errors
+    and HTTP 5xx responses without an API error. Other methods change
+    something, so they are only retried when the change surely was not
+    made: when the connection could not be established or when the API
+    rejected the call with one of SAFE_ERROR_CODES.
+    Delays grow exponentially, with full jitter.
+
+    SAFE_ERROR_CODES mean that the call has to wait until a pending VM
+    operation finishes, which takes minutes rather than seconds, so such
+    calls are retried on a separate, longer schedule: until pending_timeout
+    seconds pass, with delays growing from pending_base_delay up to
+    pending_max_delay (with equal jitter, so they never get too short).
+    """
+
+    DEFAULT_ATTEMPTS = 5
+    DEFAULT_PENDING_TIMEOUT = 600
+    SAFE_ERROR_CODES = frozenset([OktawaveAPIError.OCI_PENDING_OPS])
+    READ_ONLY_METHODS = frozenset(['LogonUser'])
+
+    def __init__(self, attempts=DEFAULT_ATTEMPTS, base_delay=1.0, max_delay=30.0,
+                 pending_timeout=DEFAULT_PENDING_TIMEOUT, pending_base_delay=5.0, pending_max_delay=60.0):
+        """Initialize the policy
+
+        Arguments:
+        - attempts (int) - maximum number of attempts per call after network
+          and server errors (1 disables these retries)
+        - base_delay (float) - upper bound of the first delay in seconds
+        - max_delay (float) - upper bound of any delay in seconds
+        - pending_timeout (float) - how long calls rejected because of a pending
+          operation are retried, in seconds (0 disables these retries)
+        - pending_base_delay, pending_max_delay (float) - upper bounds of the first
+          and of any delay between such retries, in seconds
+        """
+        self.attempts = attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.pending_timeout = pending_timeout
+        self.pending_base_delay = pending_base_delay
+        self.pending_max_delay = pending_max_delay
+
+    def is_read_only(self, method):
+        return method.startswith('Get') or method in self.READ_ONLY_METHODS
+
+    def is_transient(self, error):
+        """Tells if error means the API is (temporarily) unreachable or broken"""
+        from requests.exceptions import ConnectionError, Timeout, HTTPError
+
+        if isinstance(error, HTTPError):
+            return error.response is not None and error.response.status_code >= 500
+        return isinstance(error, (ConnectionError, Timeout))
+
+    def is_pending(self, error):
+        """Tells if error means the call has to wait for a pending operation"""
+        return isinstance(error, OktawaveAPIError) and error.code in self.SAFE_ERROR_CODES
+
+    def should_retry(self, method, error):
+        from requests.exceptions import ConnectTimeout
+
+        if isinstance(error, OktawaveAPIError):
+            return False
+        if self.is_read_only(method):
+            return self.is_transient(error)
+        return isinstance(error, ConnectTimeout)
+
+    def delay(self, attempt):
+        """Returns the number of seconds to wait after a given (0-based) failed attempt"""
+        return random.uniform(0, min(self.max_delay, self.base_delay * 2 ** attempt))
+
+    def pending_delay(self, attempt):
+        """Like delay(), for calls waiting for a pending operation"""
+        delay = min(self.pending_max_delay, self.pending_base_delay * 2 ** attempt)
+        return random.uniform(delay / 2, delay)
+
+
+class CircuitBreaker(object):
+    """Fails API calls fast while the API looks down
+
+    After failure_threshold transient failures in a row, calls fail with
+    OktawaveAPIUnavailable without being sent for reset_timeout seconds.
+    Then a single trial call is let through: the breaker closes again
+    if it succeeds and stays open for another reset_timeout if it fails.
+    """
+
+    def __init__(self, failure_threshold=5, reset_timeout=30.0):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.open_until = None
+        self.trial = False
+        self.lock = threading.Lock()
+
+    def before_call(self):
+        """Raises OktawaveAPIUnavailable if the call should not be made"""
+        with self.lock:
+            if self.open_until is None:
+                return
+            if self.trial or time() < self.open_until:
+                raise OktawaveAPIUnavailable(
+                    'Oktawave API unavailable after %d failed calls in a row' % self.failures)
+            self.trial = True
+
+    def record_success(self):
+        with self.lock:
+            self.failures = 0
+            self.open_until = None
+            self.trial = False
+
+    def record_failure(self):
+        with self.lock:
+            self.failures += 1
+            if self.trial or self.failures >= self.failure_threshold:
+                self.open_until = time() + self.reset_timeout
+            self.trial = False
+
+
+class HttpTransport(object):
+    """HTTP connection pool shared by all API clients of a process
+
+    Keeps up to pool_size keep-alive connections per host, which can be
+    used from many threads at once; threads wait for a free connection
+    instead of opening (and handshaking) throwaway ones. Responses are
+    requested gzip-compressed. The transport's circuit breaker tracks
+    the health of the API for all clients using it.
+    """
+
+    DEFAULT_POOL_SIZE = 10
+    DEFAULT_CONNECT_TIMEOUT = 10
+    DEFAULT_READ_TIMEOUT = 300
+
+    _shared = None
+    _shared_lock = threading.Lock()
+
+    def __init__(self, pool_size=DEFAULT_POOL_SIZE,
+                 connect_timeout=DEFAULT_CONNECT_TIMEOUT, read_timeout=DEFAULT_READ_TIMEOUT):
+        """Initialize the transport
+
+        Arguments:
+        - pool_size (int) - maximum number of connections kept open per host
+        - connect_timeout (float) - default connect timeout in seconds (None waits forever)
+        - read_timeout (float) - default timeout in seconds for waiting for
+          response data (None waits forever)
+        """
+        import requests
+        from requests.adapters import HTTPAdapter
+
+        session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=2, pool_maxsize=pool_size, pool_block=True)
+        session.mount('https://', adapter)
+        session.mount('http://', adapter)
+        session.headers.update({'Content-Type': 'text/json', 'Accept-Encoding': 'gzip'})
+        self.session = session
+        self.timeout = (connect_timeout, read_timeout)
+        self.breaker = CircuitBreaker()
+
+    @classmethod
+    def shared(cls):
+        """Returns the process-wide transport, creating it with default settings if needed"""
+        with cls._shared_lock:
+            if cls._shared is None:
+                cls._shared = cls()
+            return cls._shared
+
+    def post(self, url, data, auth, timeout=None, stream=False):
+        """Sends a POST request
+
+        timeout is either a number of seconds or a (connect, read) tuple,
+        the transport's defaults are used if it is None. If stream is True,
+        the response body is left to be read from response.raw.
+        """
+        return self.session.post(url, data=data, auth=auth, timeout=timeout or self.timeout, stream=stream)
+
+
 class ApiClient(object):
-    def __init__(self, url, username, password, debug=False):
+    DEFAULT_PAGE_SIZE = 100
+    # number of the first page in searchParams' PageNumber
+    FIRST_PAGE = 1
+
+    def __init__(self, url, username, password, debug=False, transport=None, retry_policy=None):
         if not url.endswith('/'):
             url += '/'
         self.url = url
-        session = requests.session()
-        session.auth = ('API\\' + username, password)
-        session.headers.update(**{'Content-Type': 'text/json'})
-        self.session = session
+        self.auth = ('API\\' + username, password)
+        if transport is None:
+            transport = HttpTransport.shared()
+        self.transport = transport
+        if retry_policy is None:
+            retry_policy = RetryPolicy()
+        self.retry_policy = retry_policy
         self.debug = debug
+        # called as handler(method, kwargs) when a call is rejected with
+        # OktawaveAccessDenied; may return updated kwargs to retry the call once
+        self.access_denied_handler = None
+
+    def call(self, method, timeout=None, **kwargs):
+        """Calls an API method with kwargs as its parameters
+
+        timeout overrides the transport's (connect, read) timeouts for this call.
+        Failed calls are retried according to the client's retry policy.
+        """
+        return self._call_handling_access_denied(self._call, method, kwargs, timeout)
+
+    def call_results(self, method, timeout=None, **kwargs):
+        """Calls an API method returning a list of results and yields its items
+
+        Takes the same arguments as call(). If ijson is installed, the
+        response is decoded as it arrives, so memory use does not grow
+        with the number of results; otherwise it is decoded as a whole.
+        """
+        backend = ijson_backend()
+        if backend is None:
+            for item in self.call(method, timeout, **kwargs)['_results']:
+                yield item
+            return
+        resp = self._call_handling_access_denied(self._open, method, kwargs, timeout)
+        try:
+            resp.raw.decode_content = True
+            for item in iter_results(resp.raw, backend):
+                if self.debug:
+                    pprint.pprint(item)
+                yield item
+        finally:
+            resp.close()
+
+    def call_paged(self, method, searchParams, page_size=None, max_items=None, timeout=None, **kwargs):
+        """Calls a paged search method and yields the results of all pages
+
+        Pages of page_size items are requested by setting PageNumber and
+        PageSize in searchParams, and each page is downloaded in the
+        background while the items of the previous one are consumed.
+        Stops after max_items items (None for no limit), after a short
+        page, and also when the server does not page as asked: when a
+        page is longer than page_size or starts like the previous one.
+        """
+        if page_size is None:
+            page_size = self.DEFAULT_PAGE_SIZE
+        if max_items is not None:
+            if max_items <= 0:
+                return
+            page_size = min(page_size, max_items)
+
+        def fetch(page_number):
+            params = dict(searchParams, PageNumber=page_number, PageSize=page_size)
+            return list(self.call_results(method, timeout, searchParams=params, **kwargs))
+
+        page_number = self.FIRST_PAGE
+        next_page = in_background(fetch, page_number)
+        count = 0
+        previous_first = None
+        while True:
+            items = next_page()
+            if items and page_number > self.FIRST_PAGE and items[0] == previous_first:
+                # PageNumber ignored, the same page again
+                if self.debug:
+                    print '-- %s returned page %d again, stopping --' % (method, page_number - 1)
+                return
+            previous_first = items[0] if items else None
+            last = len(items) != page_size or (max_items is not None and count + len(items) >= max_items)
+            if not last:
+                page_number += 1
+                next_page = in_background(fetch, page_number)
+            for item in items:
+                yield item
+                count += 1
+                if count == max_items:
+                    return
+            if last:
+                return
+
+    def _call_handling_access_denied(self, func, method, kwargs, timeout):
+        try:
+            return self._call_with_retries(func, method, kwargs, timeout)
+        except OktawaveAccessDenied:
+            if self.access_denied_handler is None:
+                raise
+            kwargs = self.access_denied_handler(method, kwargs)
+            if kwargs is None:
+                raise
+            return self._call_with_retries(func, method, kwargs, timeout)
+
+    def _call_with_retries(self, func, method, req, timeout):
+        policy = self.retry_policy
+        breaker = self.transport.breaker
+        attempt = 0
+        pending_attempt = 0
+        pending_deadline = None
+        while True:
+            breaker.before_call()
+            try:
+                res = func(method, req, timeout)
+            except Exception as e:
+                if policy.is_transient(e):
+                    breaker.record_failure()
+                else:
+                    breaker.record_success()
+                if policy.is_pending(e):
+                    if pending_deadline is None:
+                        pending_deadline = time() + policy.pending_timeout
+                    delay = policy.pending_delay(pending_attempt)
+                    pending_attempt += 1
+                    if time() + delay > pending_deadline:
+                        raise
+                else:
+                    attempt += 1
+                    if attempt >= policy.attempts or not policy.should_retry(method, e):
+                        raise
+                    delay = policy.delay(attempt - 1)
+                if self.debug:
+                    print '-- %s failed (%s), retrying in %.1f s --' % (method, e, delay)
+                sleep(delay)
+            else:
+                breaker.record_success()
+                return res
+
+    def _open(self, method, req, timeout=None):
+        """Sends a request and returns the response with its body not read yet"""
+        resp = self.transport.post(self.url + method, json.dumps(req), self.auth, timeout, stream=True)
+        if self.debug:
+            print '-- request to %s%s --' % (self.url, method)
+            pprint.pprint(req)
+            print '-- streamed response --'
+        if resp.status_code >= 400:
+            try:
+                if resp.status_code == 500:
+                    raise_api_error(resp.content)
+                resp.raise_for_status()
+            finally:
+                resp.close()
+        return resp
 
-    def call(self, method, **kwargs):
-        req = kwargs
-        resp = self.session.post(self.url + method, data=json.dumps(req))
+    def _call(self, method, req, timeout=None):
+        resp = self.transport.post(self.url + method, json.dumps(req), self.auth, timeout)
         if self.debug:
             print '-- request to %s%s --' % (self.url, method)
             pprint.pprint(req)
@@ -80,3 +80,7 @@ class OktawaveFault(OktawaveAPIError):
 
     def __str__(self):
         return self.error_msg
+
+
+class OktawaveAPIUnavailable(RuntimeError):
+    pass
@@ -0,0 +1,424 @@
+import datetime
+import os
+import sqlite3
+
+from cache import DEFAULT_CACHE_DIR
+from parallel import run_parallel, DEFAULT_CONCURRENCY
+
+# bump whenever SCHEMA changes: older databases are then recreated
+SCHEMA_VERSION = 3
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS snapshot (
+    key TEXT PRIMARY KEY,
+    value TEXT
+);
+CREATE TABLE IF NOT EXISTS changes (
+    time TEXT NOT NULL,
+    kind TEXT NOT NULL,
+    id INTEGER NOT NULL,
+    name TEXT,
+    change TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS changes_time ON changes (time);
+CREATE TABLE IF NOT EXISTS vms (
+    id INTEGER PRIMARY KEY,
+    name TEXT NOT NULL,
+    status TEXT,
+    class_name TEXT,
+    cpu_mhz INTEGER,
+    cpu_usage_mhz INTEGER,
+    memory_mb INTEGER,
+    memory_usage_mb INTEGER,
+    creation_date TEXT,
+    last_change_date TEXT,
+    details_taken_at TEXT
+);
+CREATE INDEX IF NOT EXISTS vms_name ON vms (name);
+CREATE INDEX IF NOT EXISTS vms_status ON vms (status);
+CREATE TABLE IF NOT EXISTS disks (
+    id INTEGER PRIMARY KEY,
+    name TEXT NOT NULL,
+    tier TEXT,
+    capacity_gb INTEGER,
+    used_gb REAL,
+    is_shared INTEGER
+);
+CREATE INDEX IF NOT EXISTS disks_name ON disks (name);
+CREATE TABLE IF NOT EXISTS disk_vms (
+    disk_id INTEGER NOT NULL REFERENCES disks (id) ON DELETE CASCADE,
+    vm_id INTEGER NOT NULL REFERENCES vms (id) ON DELETE CASCADE,
+    is_primary INTEGER,
+    PRIMARY KEY (disk_id, vm_id)
+);
+CREATE INDEX IF NOT EXISTS disk_vms_vm ON disk_vms (vm_id);
+CREATE TABLE IF NOT EXISTS containers (
+    id INTEGER PRIMARY KEY,
+    name TEXT NOT NULL,
+    vm_count INTEGER
+);
+CREATE INDEX IF NOT EXISTS containers_name ON containers (name);
+CREATE TABLE IF NOT EXISTS container_vms (
+    container_id INTEGER NOT NULL REFERENCES containers (id) ON DELETE CASCADE,
+    vm_id INTEGER NOT NULL REFERENCES vms (id) ON DELETE CASCADE,
+    PRIMARY KEY (container_id, vm_id)
+);
+CREATE INDEX IF NOT EXISTS container_vms_vm ON container_vms (vm_id);
+CREATE TABLE IF NOT EXISTS opns (
+    id INTEGER PRIMARY KEY,
+    name TEXT NOT NULL,
+    address_pool TEXT,
+    payment_type TEXT
+);
+CREATE INDEX IF NOT EXISTS opns_name ON opns (name);
+CREATE TABLE IF NOT EXISTS opn_vms (
+    opn_id INTEGER NOT NULL REFERENCES opns (id) ON DELETE CASCADE,
+    vm_id INTEGER NOT NULL REFERENCES vms (id) ON DELETE CASCADE,
+    mac_address TEXT,
+    private_ip_address TEXT,
+    PRIMARY KEY (opn_id, vm_id)
+);
+CREATE INDEX IF NOT EXISTS opn_vms_vm ON opn_vms (vm_id);
+CREATE TABLE IF NOT EXISTS databases (
+    id INTEGER PRIMARY KEY REFERENCES vms (id) ON DELETE CASCADE,
+    name TEXT NOT NULL,
+    type TEXT,
+    size REAL,
+    available_space REAL
+);
+CREATE INDEX IF NOT EXISTS databases_name ON databases (name);
+CREATE TABLE IF NOT EXISTS logical_databases (
+    database_id INTEGER NOT NULL REFERENCES databases (id) ON DELETE CASCADE,
+    name TEXT NOT NULL,
+    type TEXT,
+    encoding TEXT,
+    is_running INTEGER,
+    qps REAL,
+    size REAL,
+    PRIMARY KEY (database_id, name)
+);
+CREATE INDEX IF NOT EXISTS logical_databases_name ON logical_databases (name);
+'''
+
+# in the order of foreign keys, referenced tables first
+TABLES = (
+    'vms', 'disks', 'disk_vms', 'containers', 'container_vms', 'opns', 'opn_vms',
+    'databases', 'logical_databases')
+
+VM_COLUMNS = (
+    'id', 'name', 'status', 'class_name', 'cpu_mhz', 'cpu_usage_mhz', 'memory_mb', 'memory_usage_mb',
+    'creation_date', 'last_change_date', 'details_taken_at')
+
+# VM details older than this (in seconds) are fetched again by Inventory.refresh()
+DEFAULT_DETAILS_MAX_AGE = 86400
+
+TIME_FORMAT = '%Y-%m-%d %H:%M:%S'
+
+# rows of (id, name, compared values...) describing every kind of resource;
+# a resource whose values differ between two snapshots is reported as changed
+# (usage columns, like cpu_usage_mhz, are left out on purpose; the last change
+# date of VMs comes last, as it is only compared when known on both sides)
+STATE_QUERIES = (
+    ('vm', 'SELECT id, name, status, class_name, cpu_mhz, memory_mb, last_change_date FROM vms'),
+    ('disk', '''SELECT id, name, tier, capacity_gb, is_shared,
+        (SELECT group_concat(vm_id) FROM (SELECT vm_id FROM disk_vms WHERE disk_id = disks.id ORDER BY vm_id))
+        FROM disks'''),
+    ('container', '''SELECT id, name,
+        (SELECT group_concat(vm_id) FROM (
+            SELECT vm_id FROM container_vms WHERE container_id = containers.id ORDER BY vm_id))
+        FROM containers'''),
+    ('opn', '''SELECT id, name, address_pool, payment_type,
+        (SELECT group_concat(vm_id) FROM (SELECT vm_id FROM opn_vms WHERE opn_id = opns.id ORDER BY vm_id))
+        FROM opns'''),
+    ('database', '''SELECT id, name, type,
+        (SELECT group_concat(name) FROM (
+            SELECT name FROM logical_databases WHERE database_id = databases.id ORDER BY name))
+        FROM databases'''),
+)
+
+
+def _text(value):
+    """Stores dictionary items, power statuses and dates as text"""
+    if value is None:
+        return None
+    return unicode(value)
+
+
+def _now():
+    return unicode(datetime.datetime.now().replace(microsecond=0))
+
+
+def _age(text):
+    """Returns the number of seconds since a time stored by _now(), None if unknown"""
+    if not text:
+        return None
+    delta = datetime.datetime.now() - datetime.datetime.strptime(text, TIME_FORMAT)
+    return delta.days * 86400 + delta.seconds
+
+
+class Inventory(object):
+    """A local SQLite copy of the account's resources
+
+    Snapshots of VMs, disks, containers, OPNs and databases (with the
+    links between them as foreign keys) are taken with snapshot() and
+    can then be queried offline with plain SQL. Every snapshot but the
+    first records the resources added, removed or changed since the
+    previous one in the changes table.
+    """
+
+    def __init__(self, path):
+        """Open (and create if needed) the inventory database
+
+        Arguments:
+        - path (string) - database file, see default_path()
+        """
+        self.path = os.path.expanduser(path)
+        directory = os.path.dirname(self.path)
+        if directory and not os.path.isdir(directory):
+            os.makedirs(directory, 0700)
+        self.db = sqlite3.connect(self.path)
+        self.db.execute('PRAGMA foreign_keys = ON')
+        if self.db.execute('PRAGMA user_version').fetchone()[0] != SCHEMA_VERSION:
+            # a snapshot is only a copy, so an outdated one is simply dropped
+            for table in reversed(('snapshot', 'changes') + TABLES):
+                self.db.execute('DROP TABLE IF EXISTS %s' % table)
+            self.db.execute('PRAGMA user_version = %d' % SCHEMA_VERSION)
+        self.db.executescript(SCHEMA)
+
+    @classmethod
+    def default_path(cls, username, cache_dir=DEFAULT_CACHE_DIR):
+        return os.path.join(cache_dir, 'inventory-%s.sqlite' % username)
+
+    def close(self):
+        self.db.close()
+
+    @classmethod
+    def fetch(cls, api, concurrency=DEFAULT_CONCURRENCY):
+        """Downloads all resources of the account concurrently
+
+        Returns a dict of lists (or dicts of lists, for memberships) keyed
+        by table name; raises the first error encountered.
+        """
+        return cls._fetch(api, api.OCI_ListDetails, concurrency)
+
+    @classmethod
+    def _fetch(cls, api, list_vms, concurrency):
+        """Downloads the listings (VMs using list_vms), then the VMs of every OPN"""
+        api._logon()
+        listings = {
+            'vms': list_vms,
+            'disks': api.OVS_List,
+            'databases': api.ORDB_List,
+            'logical_databases': lambda: api.ORDB_LogicalDatabases(None),
+            'containers': api.Container_List,
+            'container_vms': api.Container_Memberships,
+            'opns': api.OPN_List,
+        }
+
+        def fetch_listing(name):
+            res = listings[name]()
+            return res if isinstance(res, dict) else list(res)
+
+        data = dict(cls._run(fetch_listing, sorted(listings), concurrency))
+        data['opn_vms'] = dict(cls._run(
+            lambda opn_id: api.OPN_Get(opn_id)['vms'], [opn['id'] for opn in data['opns']], concurrency))
+        return data
+
+    def refresh(self, api, concurrency=DEFAULT_CONCURRENCY, max_age=DEFAULT_DETAILS_MAX_AGE):
+        """Updates the stored snapshot, fetching details of changed VMs only
+
+        VMs are listed with the cheap GetVirtualMachinesSimple call. Only
+        VMs which are new, whose name or power state changed, whose
+        details are older than max_age seconds or were stored without
+        dates (by a full snapshot) are fetched in detail (concurrently,
+        with their creation and last change dates). The others keep their
+        stored details, except for the CPU and memory usage, which are not
+        current any more and become NULL; other changes of these VMs (e.g.
+        of their class) are not detected until their details are fetched
+        again, when a moved last change date marks them as changed too.
+        Other resources are listed as in fetch(). Without a stored
+        snapshot, takes a full one. Returns the changes, like store().
+        """
+        if self.taken_at() is None:
+            return self.snapshot(api, concurrency)
+        stored = dict(
+            (row[0], dict(zip(VM_COLUMNS, row)))
+            for row in self.db.execute('SELECT %s FROM vms' % ', '.join(VM_COLUMNS)))
+        data = self._fetch(api, api.OCI_List, concurrency)
+
+        vms = []
+        changed = {}
+        for vm in data['vms']:
+            old = stored.get(vm['id'])
+            age = None if old is None else _age(old['details_taken_at'])
+            if age is not None and age < max_age and \
+                    (old['name'], old['status']) == (vm['name'], _text(vm['status'])):
+                vms.append(dict(old, cpu_usage_mhz=None, memory_usage_mb=None))
+            else:
+                changed[vm['id']] = vm
+        for vm_id, settings in self._run(api.OCI_Settings, sorted(changed), concurrency):
+            vms.append({
+                'id': vm_id,
+                'name': settings['name'],
+                # the power state is taken from the listing, so that it compares equal next time
+                'status': changed[vm_id]['status'],
+                'class_name': settings['vm_class_name'],
+                'cpu_mhz': settings['cpu_mhz'],
+                'cpu_usage_mhz': settings['cpu_usage_mhz'],
+                'memory_mb': settings['memory_mb'],
+                'memory_usage_mb': settings['memory_usage_mb'],
+                'creation_date': settings['creation_date'],
+                'last_change_date': settings['last_change_date'],
+            })
+        data['vms'] = vms
+        return self.store(data, api.username)
+
+    @staticmethod
+    def _run(func, items, concurrency):
+        results = []
+        for item, result, error in run_parallel(func, items, concurrency):
+            if error is not None:
+                raise error
+            results.append((item, result))
+        return results
+
+    def store(self, data, username=None):
+        """Replaces the stored snapshot with data, as returned by fetch()
+
+        VM details are considered taken now, unless the VMs come without
+        their last change date (like from fetch()), in which case
+        refresh() fetches them again.
+        Returns the changes since the previous snapshot (none for the
+        first one), as (time, kind, id, name, change) tuples.
+        """
+        first = self.taken_at() is None
+        now = _now()
+        with self.db:
+            before = self._state()
+            for table in reversed(TABLES):
+                self.db.execute('DELETE FROM %s' % table)
+
+            self.db.executemany(
+                'INSERT INTO vms VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                ((vm['id'], vm['name'], _text(vm['status']), _text(vm['class_name']), vm['cpu_mhz'],
+                  vm['cpu_usage_mhz'], vm['memory_mb'], vm['memory_usage_mb'], _text(vm.get('creation_date')),
+                  _text(vm.get('last_change_date')),
+                  vm.get('details_taken_at') or (now if vm.get('last_change_date') is not None else None))
+                 for vm in data['vms']))
+            # VMs created while the listings were being downloaded can show up
+            # only in some of them; they are stored with what is known about them
+            add_vm = lambda vm_id, name, status: self.db.execute(
+                'INSERT OR IGNORE INTO vms (id, name, status) VALUES (?, ?, ?)', (vm_id, name, _text(status)))
+
+            for disk in data['disks']:
+                self.db.execute(
+                    'INSERT INTO disks VALUES (?, ?, ?, ?, ?, ?)',
+                    (disk['id'], disk['name'], _text(disk['tier']), disk['capacity_gb'], disk['used_gb'],
+                     disk['is_shared']))
+                for vm in disk['vms']:
+                    add_vm(vm['id'], vm['name'], vm['vm_status'])
+                    self.db.execute(
+                        'INSERT INTO disk_vms VALUES (?, ?, ?)', (disk['id'], vm['id'], vm['primary']))
+
+            for c in data['containers']:
+                self.db.execute('INSERT INTO containers VALUES (?, ?, ?)', (c['id'], c['name'], c['vms']))
+                for vm in data['container_vms'].get(c['id'], ()):
+                    add_vm(vm['oci_id'], vm['oci_name'], vm['status'])
+                    self.db.execute('INSERT OR IGNORE INTO container_vms VALUES (?, ?)', (c['id'], vm['oci_id']))
+
+            for opn in data['opns']:
+                self.db.execute(
+                    'INSERT INTO opns VALUES (?, ?, ?, ?)',
+                    (opn['id'], opn['name'], _text(opn['address_pool']), _text(opn['payment_type'])))
+                for vm in data['opn_vms'].get(opn['id'], ()):
+                    vm_id = vm['VirtualMachine']['VirtualMachineId']
+                    add_vm(vm_id, vm['VirtualMachine']['VirtualMachineName'], None)
+                    self.db.execute(
+                        'INSERT OR IGNORE INTO opn_vms VALUES (?, ?, ?, ?)',
+                        (opn['id'], vm_id, vm['MacAddress'], vm['PrivateIpAddress']))
+
+            for db in data['databases']:
+                add_vm(db['id'], db['name'], None)
+                self.db.execute(
+                    'INSERT INTO databases VALUES (?, ?, ?, ?, ?)',
+                    (db['id'], db['name'], _text(db['type']), db['size'], db['available_space']))
+            # logical databases of an instance created after ORDB List are skipped
+            database_ids = set(db['id'] for db in data['databases'])
+            self.db.executemany(
+                'INSERT INTO logical_databases VALUES (?, ?, ?, ?, ?, ?, ?)',
+                ((db['id'], db['name'], _text(db['type']), db['encoding'], db['is_running'], db['qps'],
+                  db['size']) for db in data['logical_databases'] if db['id'] in database_ids))
+
+            changes = [] if first else self._changes(before, self._state())
+            self.db.executemany('INSERT INTO changes VALUES (?, ?, ?, ?, ?)', changes)
+            self.db.executemany(
+                'INSERT OR REPLACE INTO snapshot VALUES (?, ?)',
+                [('taken_at', now), ('username', username)])
+        return changes
+
+    def snapshot(self, api, concurrency=DEFAULT_CONCURRENCY):
+        """Downloads the account's resources and stores them, see fetch() and store()"""
+        return self.store(self.fetch(api, concurrency), api.username)
+
+    def _state(self):
+        return dict(
+            ((kind, row[0]), row[1:]) for kind, sql in STATE_QUERIES for row in self.db.execute(sql))
+
+    def _changes(self, before, after):
+        """Compares two _state() results
+
+        Changes of VMs are dated with their creation or last change date
+        when it is known, all others with the current time. A VM also
+        changed when its last change date moved, if known in both states.
+        """
+        now = _now()
+        dates = dict(
+            (row[0], row[1:]) for row in self.db.execute('SELECT id, creation_date, last_change_date FROM vms'))
+        changes = []
+        for key in sorted(set(before) | set(after)):
+            kind, item_id = key
+            if key not in before:
+                change, date = 'added', dates.get(item_id, (None, None))[0] if kind == 'vm' else None
+            elif key not in after:
+                change, date = 'removed', None
+            elif self._differs(kind, before[key], after[key]):
+                change, date = 'changed', dates.get(item_id, (None, None))[1] if kind == 'vm' else None
+            else:
+                continue
+            name = (after.get(key) or before[key])[0]
+            changes.append((date or now, kind, item_id, name, change))
+        return changes
+
+    @staticmethod
+    def _differs(kind, before, after):
+        if kind == 'vm' and None in (before[-1], after[-1]):
+            # the last change date is unknown for VMs listed without details
+            before, after = before[:-1], after[:-1]
+        return before != after
+
+    def changes(self, since=None):
+        """Returns the changes recorded since the given datetime (all if None), oldest first"""
+        return self.db.execute(
+            'SELECT time, kind, id, name, change FROM changes WHERE time >= ? ORDER BY time, kind, id',
+            (_text(since and since.replace(microsecond=0)) or '',)).fetchall()
+
+    def counts(self):
+        return dict(
+            (table, self.db.execute('SELECT COUNT(*) FROM %s' % table).fetchone()[0]) for table in TABLES)
+
+    def taken_at(self):
+        """Returns the local time of the last snapshot (as text) or None"""
+        row = self.db.execute("SELECT value FROM snapshot WHERE key = 'taken_at'").fetchone()
+        return None if row is None else row[0]
+
+    def columns(self, table):
+        return [row[1] for row in self.db.execute('PRAGMA table_info(%s)' % table)]
+
+    def query(self, sql, params=()):
+        """Runs a read-only SQL query
+
+        Returns the column names and an iterator over the result rows.
+        """
+        self.db.execute('PRAGMA query_only = ON')
+        cursor = self.db.execute(sql, params)
+        return [col[0] for col in cursor.description or ()], cursor
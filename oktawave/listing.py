@@ -0,0 +1,293 @@
+import heapq
+import re
+from collections import OrderedDict
+from decimal import Decimal
+from itertools import islice
+
+NUMBER_TYPES = (int, long, float, Decimal)
+
+
+class ListQueryError(ValueError):
+    pass
+
+
+class Column(object):
+    """A column of a list command
+
+    Arguments:
+    - name (string) - column name, as used in --columns, --where and --sort
+    - header (string) - table header
+    - fields (tuple) - record fields the column is computed from
+    - value (function) - returns the column value of a record (used for
+      filtering, sorting and json output), defaults to the first field
+    - display (function) - formats the column value for tables (optional)
+    - aliases (dict) - shorthands accepted for values in --where, e.g. "on"
+    """
+
+    def __init__(self, name, header, fields=None, value=None, display=None, aliases=None):
+        self.name = name
+        self.header = header
+        self.fields = fields or (name,)
+        self.value = value or (lambda record, field=self.fields[0]: record[field])
+        self.display = display or self.value
+        self.aliases = aliases or {}
+
+
+POWER_STATUS_ALIASES = {'on': 'Powered on', 'off': 'Powered off'}
+
+TOKEN_RE = re.compile(r'''\s*(?:
+    (?P<string>'[^']*'|"[^"]*") |
+    (?P<op>!=|<=|>=|==|!~|[=<>~]) |
+    (?P<paren>[()]) |
+    (?P<word>[^\s()=<>~!'"]+)
+)''', re.X)
+
+COMPARISONS = {
+    '=': lambda a, b: a == b,
+    '==': lambda a, b: a == b,
+    '!=': lambda a, b: a != b,
+    '<': lambda a, b: a < b,
+    '<=': lambda a, b: a <= b,
+    '>': lambda a, b: a > b,
+    '>=': lambda a, b: a >= b,
+}
+
+
+def tokenize(expr):
+    tokens = []
+    pos = 0
+    expr = expr.rstrip()
+    while pos < len(expr):
+        match = TOKEN_RE.match(expr, pos)
+        if match is None or match.end() == pos:
+            raise ListQueryError('invalid --where expression near: %s' % expr[pos:].strip())
+        kind = match.lastgroup
+        text = match.group(kind)
+        if kind == 'string':
+            text = text[1:-1]
+        tokens.append((kind, text))
+        pos = match.end()
+    return tokens
+
+
+class WhereParser(object):
+    """Compiles a --where expression into a predicate over records
+
+    The grammar is: comparisons "column OP value" (OP being =, !=, <, <=,
+    >, >=, ~ or !~, the last two matching a regular expression), combined
+    with "and", "or", "not" and parentheses. Values may be quoted.
+    Numbers compare numerically with numeric columns, everything else
+    compares as case-insensitive text. Ordering a numeric value against
+    a value which is not a (finite) number raises ListQueryError when the
+    predicate meets such a value, as column types are not known upfront.
+    """
+
+    def __init__(self, columns):
+        self.columns = columns
+
+    def compile(self, expr):
+        self.tokens = tokenize(expr)
+        self.pos = 0
+        self.used = set()
+        predicate = self._or()
+        if self.pos != len(self.tokens):
+            raise ListQueryError('unexpected "%s" in --where expression' % self.tokens[self.pos][1])
+        return predicate
+
+    def _peek(self):
+        if self.pos < len(self.tokens):
+            return self.tokens[self.pos]
+        return None, None
+
+    def _next(self, what):
+        if self.pos >= len(self.tokens):
+            raise ListQueryError('unexpected end of --where expression, expected %s' % what)
+        token = self.tokens[self.pos]
+        self.pos += 1
+        return token
+
+    def _keyword(self, word):
+        kind, text = self._peek()
+        if kind == 'word' and text.lower() == word:
+            self.pos += 1
+            return True
+        return False
+
+    def _or(self):
+        terms = [self._and()]
+        while self._keyword('or'):
+            terms.append(self._and())
+        if len(terms) == 1:
+            return terms[0]
+        return lambda record: any(term(record) for term in terms)
+
+    def _and(self):
+        terms = [self._not()]
+        while self._keyword('and'):
+            terms.append(self._not())
+        if len(terms) == 1:
+            return terms[0]
+        return lambda record: all(term(record) for term in terms)
+
+    def _not(self):
+        if self._keyword('not'):
+            term = self._not()
+            return lambda record: not term(record)
+        if self._peek() == ('paren', '('):
+            self.pos += 1
+            term = self._or()
+            if self._next('")"') != ('paren', ')'):
+                raise ListQueryError('missing ")" in --where expression')
+            return term
+        return self._comparison()
+
+    def _comparison(self):
+        kind, name = self._next('a column name')
+        if kind != 'word':
+            raise ListQueryError('expected a column name instead of "%s"' % name)
+        column = self.columns.get(name)
+        if column is None:
+            raise ListQueryError('unknown column in --where: %s (available: %s)' % (
+                name, ', '.join(sorted(self.columns))))
+        self.used.add(column)
+        kind, op = self._next('an operator')
+        if kind != 'op':
+            raise ListQueryError('expected an operator after "%s"' % name)
+        kind, literal = self._next('a value')
+        if kind not in ('word', 'string'):
+            raise ListQueryError('expected a value after "%s %s"' % (name, op))
+        literal = column.aliases.get(literal.lower(), literal)
+        return self._compare(column.value, op, literal)
+
+    @staticmethod
+    def _compare(get, op, literal):
+        if op in ('~', '!~'):
+            try:
+                regex = re.compile(literal, re.I | re.U)
+            except re.error as e:
+                raise ListQueryError('invalid regular expression %r: %s' % (literal, e))
+            matches = op == '~'
+            return lambda record: bool(regex.search(unicode(get(record)))) == matches
+
+        compare = COMPARISONS[op]
+        text = literal.lower()
+        try:
+            number = Decimal(literal)
+        except ArithmeticError:
+            number = None
+        if number is not None and not number.is_finite():
+            # "nan" or "inf" cannot be compared with numbers, but may be text
+            number = None
+        ordering = op not in ('=', '==', '!=')
+
+        def predicate(record):
+            value = get(record)
+            if value is None:
+                return op == '!='
+            if isinstance(value, NUMBER_TYPES) and not isinstance(value, bool):
+                if number is not None:
+                    return compare(Decimal(str(value)), number)
+                if ordering:
+                    raise ListQueryError('"%s" is not a number, cannot use it with %s on a numeric column' % (
+                        literal, op))
+            return compare(unicode(value).lower(), text)
+
+        return predicate
+
+
+def sort_key(value):
+    """Orders missing values first, numbers numerically and everything else as text"""
+    if value is None:
+        return 0, None
+    if isinstance(value, NUMBER_TYPES):
+        return 1, value
+    return 2, unicode(value).lower()
+
+
+class ListQuery(object):
+    """The --where, --sort, --columns and --limit options of a list command
+
+    Arguments:
+    - columns (list of Column) - all columns of the command
+    - default (list of strings) - columns shown without --columns
+    - where (string) - filter expression, see WhereParser
+    - sort (string) - comma-separated columns to sort by, "-" before
+      a column sorts in descending order
+    - select (string) - comma-separated columns to show
+    - limit (int) - maximum number of records to show
+    The options are parsed and validated (raising ListQueryError) once,
+    when the query is created.
+    """
+
+    def __init__(self, columns, default, where=None, sort=None, select=None, limit=None):
+        self.by_name = dict((column.name, column) for column in columns)
+        self.selected = [self._column(name, '--columns') for name in self._names(select)] if select \
+            else [self.by_name[name] for name in default]
+        self.explicit = bool(select)
+        used = set(self.selected)
+
+        self.predicate = None
+        self.where_fields = set()
+        if where:
+            parser = WhereParser(self.by_name)
+            self.predicate = parser.compile(where)
+            used.update(parser.used)
+            self.where_fields = set(field for column in parser.used for field in column.fields)
+
+        self.sort = []
+        for name in self._names(sort):
+            descending = name.startswith('-')
+            column = self._column(name.lstrip('-+'), '--sort')
+            self.sort.append((column, descending))
+            used.add(column)
+
+        if limit is not None and limit < 0:
+            raise ListQueryError('--limit must not be negative')
+        self.limit = limit
+        self.used = used
+
+    @staticmethod
+    def _names(value):
+        return [name.strip() for name in (value or '').split(',') if name.strip()]
+
+    def _column(self, name, option):
+        column = self.by_name.get(name)
+        if column is None:
+            raise ListQueryError('unknown column in %s: %s (available: %s)' % (
+                option, name, ', '.join(sorted(self.by_name))))
+        return column
+
+    def fields(self):
+        """Returns the record fields needed by the shown, filtered and sorted columns"""
+        return set(field for column in self.used for field in column.fields)
+
+    def apply(self, records):
+        """Filters, sorts and limits records, lazily where possible
+
+        Without --sort, records are yielded as they come and the upstream
+        generator is not consumed beyond --limit matching records.
+        """
+        if self.predicate is not None:
+            records = (record for record in records if self.predicate(record))
+        if self.sort:
+            if self.limit is not None and len(self.sort) == 1 and not self.sort[0][1]:
+                # keep only the first --limit records in memory
+                column = self.sort[0][0]
+                return iter(heapq.nsmallest(self.limit, records, key=lambda r: sort_key(column.value(r))))
+            records = list(records)
+            # stable sorts, least significant column first
+            for column, descending in reversed(self.sort):
+                records.sort(key=lambda r: sort_key(column.value(r)), reverse=descending)
+        if self.limit is not None:
+            records = islice(records, self.limit)
+        return iter(records)
+
+    def head(self):
+        return [column.header for column in self.selected]
+
+    def row(self, record):
+        return [column.display(record) for column in self.selected]
+
+    def to_json(self, record):
+        """Returns the shown columns of a record, for json output of --columns"""
+        return OrderedDict((column.name, column.value(record)) for column in self.selected)
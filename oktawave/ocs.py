@@ -0,0 +1,673 @@
+import hashlib
+import json
+import os
+import threading
+
+from parallel import run_parallel, DEFAULT_CONCURRENCY
+
+MB = 1024 * 1024
+
+
+class SegmentReader(object):
+    """File-like view of a part of a local file
+
+    Computes the MD5 of the data read, so that it can be compared with
+    the ETag returned by the server.
+    """
+
+    def __init__(self, local_path, offset, length):
+        self.fh = open(local_path, 'rb')
+        self.fh.seek(offset)
+        self.remaining = length
+        self.md5 = hashlib.md5()
+
+    def read(self, size=-1):
+        if size < 0 or size > self.remaining:
+            size = self.remaining
+        data = self.fh.read(size)
+        self.remaining -= len(data)
+        self.md5.update(data)
+        return data
+
+    def close(self):
+        self.fh.close()
+
+
+def file_md5(local_path, offset=0, length=None, block_size=MB):
+    """Returns the hex MD5 digest of (a part of) a local file"""
+    if length is None:
+        length = os.path.getsize(local_path) - offset
+    reader = SegmentReader(local_path, offset, length)
+    try:
+        while reader.read(block_size):
+            pass
+    finally:
+        reader.close()
+    return reader.md5.hexdigest()
+
+
+class ConnectionPool(object):
+    """Hands out a separate OCSConnection to every thread
+
+    swiftclient connections are not thread-safe, so worker threads get
+    clones of the main connection that reuse its authentication token.
+    """
+
+    def __init__(self, connection):
+        self.connection = connection
+        self.local = threading.local()
+
+    def get(self):
+        conn = getattr(self.local, 'connection', None)
+        if conn is None:
+            conn = self.local.connection = self.connection.clone()
+        return conn
+
+    def reset(self):
+        """Drops the current thread's connection, e.g. after an error"""
+        self.local.connection = None
+
+
+def list_objects(connection, container, prefix=None, delimiter=None, limit=None, page_size=1000):
+    """Iterates over objects in a container, one page at a time
+
+    prefix and delimiter are passed to the server, so only the matching
+    objects (and with a delimiter, "subdir" entries for pseudo-directories)
+    are transferred. Pages are requested with the last seen name as the
+    marker, so memory usage does not depend on the size of the container.
+    At most limit entries are yielded (if given).
+    """
+    marker = ''
+    count = 0
+    while limit is None or count < limit:
+        page_limit = page_size if limit is None else min(page_size, limit - count)
+        _headers, page = connection.get_container(
+            container, marker=marker, limit=page_limit, prefix=prefix, delimiter=delimiter)
+        if not page:
+            return
+        for obj in page:
+            yield obj
+        count += len(page)
+        marker = page[-1].get('name', page[-1].get('subdir'))
+
+
+def is_not_found(error):
+    """Tells if error is a swiftclient ClientException for a 404 response
+
+    Checked by attribute, so that swiftclient does not have to be imported here.
+    """
+    return getattr(error, 'http_status', None) == 404
+
+
+def manifest_segments(connection, container, path, headers=None):
+    """Returns the segments of a large object as (container, name, size, etag) tuples
+
+    or None if the object is not a static or dynamic large object.
+    headers are the object's HEAD response headers, requested if not given.
+    """
+    from urllib import unquote
+
+    if headers is None:
+        headers = connection.head_object(container, path)
+    if is_static_large_object(headers):
+        _headers, body = connection.get_object(container, path, query_string='multipart-manifest=get')
+        return [
+            tuple(unquote(segment['name']).lstrip('/').split('/', 1)) + (segment['bytes'], segment['hash'])
+            for segment in json.loads(body)]
+    if headers.get('x-object-manifest'):
+        seg_container, prefix = unquote(headers['x-object-manifest']).split('/', 1)
+        _headers, objects = connection.get_container(seg_container, prefix=prefix, full_listing=True)
+        return [
+            (seg_container, obj['name'], obj['bytes'], obj['hash'])
+            for obj in sorted(objects, key=lambda obj: obj['name'])]
+    return None
+
+
+def is_static_large_object(headers):
+    return headers.get('x-static-large-object', '').lower() == 'true'
+
+
+def delete_segments(connection, segments, keep=()):
+    """Deletes segments of a large object, except those still in use
+
+    Arguments:
+    - segments (list) - (container, name, size, etag) tuples, see manifest_segments()
+    - keep (set) - (container, name) pairs of segments not to delete
+    """
+    for seg_container, name, _size, _etag in segments:
+        if (seg_container, name) in keep:
+            continue
+        try:
+            connection.delete_object(seg_container, name)
+        except Exception as e:
+            if not is_not_found(e):
+                raise
+
+
+def with_retries(func, retries, on_error=None):
+    """Calls func() up to retries times, until it does not raise an exception
+
+    on_error (if given) is called after every failed attempt.
+    """
+    last_error = None
+    for _attempt in xrange(max(1, retries)):
+        try:
+            return func()
+        except Exception as e:
+            last_error = e
+            if on_error is not None:
+                on_error()
+    raise last_error
+
+
+class SegmentedUpload(object):
+    """Uploads a large file as a set of concurrently uploaded segments
+
+    Segments are stored in the "<container>_segments" container under
+    "<path>/<mtime>/<size>/<segment size>/<index>" (the same layout as
+    the swift command line tool uses), so that an interrupted upload
+    of an unchanged file can be resumed by skipping the segments that
+    already exist with matching ETags. Once all segments are in place,
+    a static (SLO) or dynamic (DLO) large object manifest is written
+    to container/path.
+    """
+
+    DEFAULT_SEGMENT_SIZE = 1024 * MB
+    DEFAULT_RETRIES = 3
+    MANIFEST_TYPES = ('static', 'dynamic')
+
+    def __init__(self, connection, local_path, container, path,
+                 segment_size=DEFAULT_SEGMENT_SIZE, concurrency=DEFAULT_CONCURRENCY,
+                 manifest='static', retries=DEFAULT_RETRIES):
+        """Initialize the upload
+
+        Arguments:
+        - connection (OCSConnection) - connection to clone for worker threads
+        - local_path (string) - file to upload
+        - container, path (string) - destination object
+        - segment_size (int) - segment size in bytes
+        - concurrency (int) - maximum number of segments uploaded at once
+        - manifest (string) - 'static' or 'dynamic'
+        - retries (int) - number of attempts for every segment
+        """
+        if manifest not in self.MANIFEST_TYPES:
+            raise ValueError('Unknown manifest type: %s' % manifest)
+        self.pool = ConnectionPool(connection)
+        self.local_path = local_path
+        self.container = container
+        self.path = path
+        self.segment_size = segment_size
+        self.concurrency = concurrency
+        self.manifest = manifest
+        self.retries = max(1, retries)
+
+        stat = os.stat(local_path)
+        self.size = stat.st_size
+        self.mtime = stat.st_mtime
+        # ETag of the object listed in the container, set by run()
+        self.etag = None
+        self.segment_container = container + '_segments'
+        self.segment_prefix = '%s/%f/%d/%d/' % (path, stat.st_mtime, self.size, segment_size)
+
+    def segments(self):
+        """Returns a list of (segment name, offset, length) tuples"""
+        res = []
+        offset = 0
+        while offset < self.size:
+            length = min(self.segment_size, self.size - offset)
+            res.append(('%s%08d' % (self.segment_prefix, len(res)), offset, length))
+            offset += length
+        return res
+
+    def _existing_segments(self):
+        """Returns a dict mapping names of already uploaded segments to their (size, etag)"""
+        try:
+            _headers, objects = self.pool.get().get_container(
+                self.segment_container, prefix=self.segment_prefix, full_listing=True)
+        except Exception as e:
+            if not is_not_found(e):
+                raise
+            return {}
+        return dict((obj['name'], (obj['bytes'], obj['hash'])) for obj in objects)
+
+    def _upload_segment(self, name, offset, length):
+        def upload():
+            reader = SegmentReader(self.local_path, offset, length)
+            try:
+                etag = self.pool.get().put_object(
+                    self.segment_container, name, reader, content_length=length)
+            finally:
+                reader.close()
+            etag = etag.strip('"')
+            if etag != reader.md5.hexdigest():
+                raise ValueError('ETag mismatch for segment %s' % name)
+            return etag
+
+        return with_retries(upload, self.retries, self.pool.reset)
+
+    def run(self):
+        """Uploads missing segments and writes the manifest
+
+        Returns a (number of uploaded segments, number of skipped segments) tuple.
+        """
+        segments = self.segments()
+        conn = self.pool.get()
+        conn.put_container(self.segment_container)
+        existing = self._existing_segments()
+
+        def upload(segment):
+            name, offset, length = segment
+            if name in existing:
+                size, etag = existing[name]
+                if size == length and etag == file_md5(self.local_path, offset, length):
+                    return etag, False
+            return self._upload_segment(name, offset, length), True
+
+        results = run_parallel(upload, segments, self.concurrency)
+        for segment, _res, error in results:
+            if error is not None:
+                raise error
+
+        if self.manifest == 'static':
+            manifest = [{
+                'path': '/%s/%s' % (self.segment_container, name),
+                'etag': etag,
+                'size_bytes': length,
+            } for (name, _offset, length), (etag, _uploaded), _error in results]
+            conn.put_object(self.container, self.path, json.dumps(manifest),
+                            query_string='multipart-manifest=put')
+            # the MD5 of the concatenated segment ETags, not of the whole file
+            self.etag = hashlib.md5(''.join(segment['etag'] for segment in manifest)).hexdigest()
+        else:
+            self.etag = conn.put_object(self.container, self.path, '', headers={
+                'X-Object-Manifest': '%s/%s' % (self.segment_container, self.segment_prefix)}).strip('"')
+
+        uploaded = len([1 for _segment, (_etag, was_uploaded), _error in results if was_uploaded])
+        return uploaded, len(results) - uploaded
+
+
+class RangedDownload(object):
+    """Downloads an object to a local file using concurrent requests
+
+    Large objects (static or dynamic manifests) are fetched segment by
+    segment, other objects in chunks requested with HTTP Range headers.
+    Every part is written at its offset into a preallocated file, while
+    the list of finished parts is kept in "<local path>.parts", so that
+    an interrupted download of an unchanged object can be resumed.
+    The result is verified against the object's ETag.
+    """
+
+    DEFAULT_CHUNK_SIZE = 64 * MB
+    DEFAULT_RETRIES = 3
+
+    def __init__(self, connection, container, path, local_path,
+                 chunk_size=DEFAULT_CHUNK_SIZE, concurrency=DEFAULT_CONCURRENCY, retries=DEFAULT_RETRIES):
+        """Initialize the download
+
+        Arguments:
+        - connection (OCSConnection) - connection to clone for worker threads
+        - container, path (string) - object to download
+        - local_path (string) - destination file
+        - chunk_size (int) - size of ranges requested for plain objects, in bytes
+        - concurrency (int) - maximum number of parts downloaded at once
+        - retries (int) - number of attempts for every part
+        """
+        self.pool = ConnectionPool(connection)
+        self.container = container
+        self.path = path
+        self.local_path = local_path
+        self.state_path = local_path + '.parts'
+        self.chunk_size = chunk_size
+        self.concurrency = concurrency
+        self.retries = retries
+        self.state_lock = threading.Lock()
+
+    def _manifest_parts(self, headers):
+        """Returns a list of (container, object, offset, length, etag) parts of a large object
+
+        or None if the object is not a large object.
+        """
+        segments = manifest_segments(self.pool.get(), self.container, self.path, headers)
+        if segments is None:
+            return None
+
+        parts = []
+        offset = 0
+        for seg_container, name, length, etag in segments:
+            parts.append((seg_container, name, offset, length, etag))
+            offset += length
+        return parts
+
+    def _range_parts(self, size):
+        return [
+            (self.container, self.path, offset, min(self.chunk_size, size - offset), None)
+            for offset in xrange(0, size, self.chunk_size)]
+
+    def _load_state(self, etag, size):
+        try:
+            with open(self.state_path) as fh:
+                state = json.load(fh)
+        except (IOError, ValueError):
+            return set()
+        if state.get('etag') != etag or state.get('size') != size or \
+                os.path.getsize(self.local_path) != size:
+            return set()
+        return set(state.get('done', []))
+
+    def _mark_done(self, etag, size, done, index):
+        with self.state_lock:
+            done.add(index)
+            with open(self.state_path, 'w') as fh:
+                json.dump({'etag': etag, 'size': size, 'done': sorted(done)}, fh)
+
+    def _download_part(self, part):
+        seg_container, name, offset, length, etag = part
+        headers = {}
+        if etag is None:
+            headers['Range'] = 'bytes=%d-%d' % (offset, offset + length - 1)
+
+        def download():
+            _headers, body = self.pool.get().get_object(
+                seg_container, name, resp_chunk_size=MB, headers=headers)
+            md5 = hashlib.md5()
+            written = 0
+            with open(self.local_path, 'r+b') as fh:
+                fh.seek(offset)
+                for chunk in body:
+                    fh.write(chunk)
+                    md5.update(chunk)
+                    written += len(chunk)
+            if written != length:
+                raise IOError('Short read of %s/%s: %d of %d bytes' % (seg_container, name, written, length))
+            if etag is not None and md5.hexdigest() != etag:
+                raise ValueError('ETag mismatch for %s/%s' % (seg_container, name))
+
+        with_retries(download, self.retries, self.pool.reset)
+
+    def run(self):
+        """Downloads missing parts and verifies the result
+
+        Returns a (number of downloaded parts, number of skipped parts) tuple.
+        """
+        headers = self.pool.get().head_object(self.container, self.path)
+        size = int(headers['content-length'])
+        etag = headers['etag'].strip('"')
+        parts = self._manifest_parts(headers)
+        if parts is None:
+            parts = self._range_parts(size)
+
+        done = set()
+        if os.path.exists(self.local_path):
+            done = self._load_state(etag, size)
+        else:
+            open(self.local_path, 'wb').close()
+        with open(self.local_path, 'r+b') as fh:
+            fh.truncate(size)
+
+        def download(index):
+            self._download_part(parts[index])
+            self._mark_done(etag, size, done, index)
+
+        todo = [index for index in xrange(len(parts)) if index not in done]
+        for _index, _res, error in run_parallel(download, todo, self.concurrency):
+            if error is not None:
+                raise error
+
+        if parts and parts[0][4] is not None:
+            # large object: ETag is the MD5 of the concatenated segment ETags
+            actual = hashlib.md5(''.join(part[4] for part in parts)).hexdigest()
+        else:
+            actual = file_md5(self.local_path)
+        if actual != etag:
+            raise ValueError('ETag mismatch for %s/%s' % (self.container, self.path))
+
+        if os.path.exists(self.state_path):
+            os.unlink(self.state_path)
+        return len(todo), len(parts) - len(todo)
+
+
+class DirectorySync(object):
+    """Synchronises a local directory with a container (or a prefix within it)
+
+    Files are compared by size and MD5 (against remote ETags). MD5s of
+    local files are kept in a hash manifest (".oktawave-sync" in the local
+    directory) together with the size and mtime they were computed for,
+    so unchanged files are not hashed again. Files larger than the segment
+    size are uploaded as static large objects, whose ETag is not the MD5
+    of the file, so the ETag they were uploaded with is kept in the hash
+    manifest as well. Only new or changed files are transferred, on a pool
+    of worker threads; extraneous files on the destination side are removed
+    (together with their segments) only if delete is True.
+    """
+
+    HASHES_FILE = '.oktawave-sync'
+    DEFAULT_RETRIES = 3
+
+    def __init__(self, connection, local_dir, container, prefix='', download=False, delete=False,
+                 dry_run=False, concurrency=DEFAULT_CONCURRENCY,
+                 segment_size=SegmentedUpload.DEFAULT_SEGMENT_SIZE, retries=DEFAULT_RETRIES, report=None):
+        """Initialize the synchronisation
+
+        Arguments:
+        - connection (OCSConnection) - connection to clone for worker threads
+        - local_dir (string) - local directory
+        - container, prefix (string) - remote location
+        - download (bool) - copy from OCS to local_dir instead of the other way round
+        - delete (bool) - remove destination files missing on the source side
+        - dry_run (bool) - only report what would be done
+        - concurrency (int) - maximum number of files transferred at once
+        - segment_size (int) - upload larger files in segments of this size (bytes)
+        - retries (int) - number of attempts for every file
+        - report (callable) - called as report(action, name) for every
+          transferred or deleted file (optional)
+        """
+        self.pool = ConnectionPool(connection)
+        self.local_dir = local_dir
+        self.container = container
+        if prefix and not prefix.endswith('/'):
+            prefix += '/'
+        self.prefix = prefix or ''
+        self.download = download
+        self.delete = delete
+        self.dry_run = dry_run
+        self.concurrency = concurrency
+        self.segment_size = segment_size
+        self.retries = retries
+        self.report = report
+        self.remote = {}
+        self.container_missing = False
+        self.hashes_path = os.path.join(local_dir, self.HASHES_FILE)
+        self.hashes = {}
+
+    def _load_hashes(self):
+        try:
+            with open(self.hashes_path) as fh:
+                self.hashes = json.load(fh)
+        except (IOError, ValueError):
+            self.hashes = {}
+
+    def _save_hashes(self):
+        tmp_path = self.hashes_path + '.tmp'
+        with open(tmp_path, 'w') as fh:
+            json.dump(self.hashes, fh)
+        os.rename(tmp_path, self.hashes_path)
+
+    def _local_path(self, name):
+        return os.path.join(self.local_dir, *name.split('/'))
+
+    def local_files(self):
+        """Returns a dict mapping relative names of local files to their (size, mtime)"""
+        res = {}
+        for dir_path, _dir_names, file_names in os.walk(self.local_dir):
+            rel_dir = os.path.relpath(dir_path, self.local_dir)
+            for file_name in file_names:
+                if rel_dir == '.':
+                    if file_name in (self.HASHES_FILE, self.HASHES_FILE + '.tmp'):
+                        continue
+                    name = file_name
+                else:
+                    name = '/'.join(rel_dir.split(os.sep) + [file_name])
+                stat = os.stat(os.path.join(dir_path, file_name))
+                res[name] = (stat.st_size, stat.st_mtime)
+        return res
+
+    def remote_files(self):
+        """Returns a dict mapping relative names of remote objects to their (size, etag, last_modified)"""
+        res = {}
+        try:
+            for obj in list_objects(self.pool.get(), self.container, prefix=self.prefix or None):
+                if obj['content_type'] == 'application/directory' or obj['name'].endswith('/'):
+                    continue
+                res[obj['name'][len(self.prefix):]] = (obj['bytes'], obj['hash'], obj['last_modified'])
+        except Exception as e:
+            if not is_not_found(e) or self.download:
+                raise
+            self.container_missing = True
+        return res
+
+    def _cached_hashes(self, name, size, mtime):
+        """Returns the hash manifest entry of a local file, if it is still valid"""
+        cached = self.hashes.get(name)
+        if cached is not None and cached[0] == size and cached[1] == mtime:
+            return cached
+        return None
+
+    def local_md5(self, name, size, mtime):
+        """Returns the MD5 of a local file, from the hash manifest if it is still valid"""
+        cached = self._cached_hashes(name, size, mtime)
+        if cached is not None and cached[2] is not None:
+            return cached[2]
+        md5 = file_md5(self._local_path(name))
+        self.hashes[name] = [size, mtime, md5]
+        return md5
+
+    def uploaded_etag(self, name, size, mtime):
+        """Returns the ETag of the large object a local file was uploaded as, if it is unchanged since"""
+        cached = self._cached_hashes(name, size, mtime)
+        if cached is not None and len(cached) > 3:
+            return cached[3]
+        return None
+
+    def plan(self):
+        """Compares both sides
+
+        Returns a (names to transfer, names to delete, number of unchanged files) tuple.
+        """
+        local = self.local_files()
+        remote = self.remote = self.remote_files()
+        self.hashes = dict((name, value) for name, value in self.hashes.iteritems() if name in local)
+        source, destination = (remote, local) if self.download else (local, remote)
+
+        def changed(name):
+            if name not in destination:
+                return True
+            local_size, local_mtime = local[name]
+            remote_size, remote_etag = remote[name][:2]
+            if local_size != remote_size:
+                return True
+            if not self.download and self.uploaded_etag(name, local_size, local_mtime) == remote_etag:
+                return False
+            return self.local_md5(name, local_size, local_mtime) != remote_etag
+
+        results = run_parallel(changed, sorted(source), self.concurrency)
+        for _name, _res, error in results:
+            if error is not None:
+                raise error
+        transfer = [name for name, is_changed, _error in results if is_changed]
+        delete = sorted(set(destination) - set(source)) if self.delete else []
+        return transfer, delete, len(results) - len(transfer)
+
+    def _segments(self, name):
+        """Returns the segments of a remote large object, see manifest_segments()"""
+        try:
+            return manifest_segments(self.pool.get(), self.container, self.prefix + name)
+        except Exception as e:
+            if not is_not_found(e):
+                raise
+            return None
+
+    def _upload(self, name):
+        local_path = self._local_path(name)
+        conn = self.pool.get()
+        # segments of the replaced object, deleted once it is overwritten
+        old_segments = self._segments(name) if name in self.remote else None
+        keep = set()
+        if os.path.getsize(local_path) > self.segment_size:
+            upload = SegmentedUpload(conn, local_path, self.container, self.prefix + name,
+                                     segment_size=self.segment_size, concurrency=1)
+            upload.run()
+            cached = self._cached_hashes(name, upload.size, upload.mtime)
+            self.hashes[name] = [upload.size, upload.mtime, cached and cached[2], upload.etag]
+            keep = set((upload.segment_container, segment[0]) for segment in upload.segments())
+        else:
+            with open(local_path, 'rb') as fh:
+                conn.put_object(self.container, self.prefix + name, fh)
+        if old_segments:
+            delete_segments(conn, old_segments, keep)
+
+    def _download(self, name):
+        local_path = self._local_path(name)
+        local_dir = os.path.dirname(local_path)
+        if not os.path.isdir(local_dir):
+            try:
+                os.makedirs(local_dir)
+            except OSError:
+                # created by another worker in the meantime
+                if not os.path.isdir(local_dir):
+                    raise
+        tmp_path = local_path + '.oktawave-tmp'
+        _headers, body = self.pool.get().get_object(self.container, self.prefix + name, resp_chunk_size=MB)
+        with open(tmp_path, 'wb') as fh:
+            for chunk in body:
+                fh.write(chunk)
+        os.rename(tmp_path, local_path)
+        stat = os.stat(local_path)
+        self.hashes[name] = [stat.st_size, stat.st_mtime, self.remote[name][1]]
+
+    def _delete(self, name):
+        if self.download:
+            os.unlink(self._local_path(name))
+            self.hashes.pop(name, None)
+        else:
+            conn = self.pool.get()
+            path = self.prefix + name
+            try:
+                headers = conn.head_object(self.container, path)
+            except Exception as e:
+                if not is_not_found(e):
+                    raise
+                return
+            if is_static_large_object(headers):
+                conn.delete_object(self.container, path, query_string='multipart-manifest=delete')
+                return
+            segments = manifest_segments(conn, self.container, path, headers)
+            conn.delete_object(self.container, path)
+            if segments:
+                delete_segments(conn, segments)
+
+    def run(self):
+        """Synchronises both sides
+
+        Returns a (transferred, deleted, unchanged, errors) tuple, where
+        errors is a list of (name, exception) pairs.
+        """
+        self._load_hashes()
+        transfer, delete, unchanged = self.plan()
+        if self.container_missing and not self.dry_run:
+            self.pool.get().put_container(self.container)
+        transfer_func = self._download if self.download else self._upload
+        actions = [(transfer_func, 'download' if self.download else 'upload', name) for name in transfer] + \
+                  [(self._delete, 'delete', name) for name in delete]
+
+        def run_action(action):
+            func, label, name = action
+            if not self.dry_run:
+                with_retries(lambda: func(name), self.retries, self.pool.reset)
+            if self.report is not None:
+                self.report(label, name)
+
+        results = run_parallel(run_action, actions, self.concurrency)
+        if not self.dry_run:
+            self._save_hashes()
+        errors = [(action[2], error) for action, _res, error in results if error is not None]
+        return len(transfer), len(delete), unchanged, errors
@@ -0,0 +1,59 @@
+DEFAULT_CONCURRENCY = 8
+
+
+def run_parallel(func, items, concurrency=DEFAULT_CONCURRENCY):
+    """Calls func(item) for every item on a bounded pool of threads
+
+    Returns a list of (item, result, error) tuples in the order of items,
+    where error is the exception raised by func (and result is None)
+    or None if the call succeeded.
+    """
+    items = list(items)
+    if not items:
+        return []
+
+    from multiprocessing.pool import ThreadPool
+
+    def run(item):
+        try:
+            return item, func(item), None
+        except Exception as e:
+            return item, None, e
+
+    pool = ThreadPool(max(1, min(concurrency, len(items))))
+    try:
+        return pool.map(run, items)
+    finally:
+        pool.close()
+        pool.join()
+
+
+def in_background(func, *args):
+    """Starts func(*args) in a background thread
+
+    Returns a function which waits for the call to finish and returns its
+    result (or raises the exception raised by func).
+    """
+    import sys
+    import threading
+
+    outcome = {}
+
+    def run():
+        try:
+            outcome['result'] = func(*args)
+        except Exception:
+            outcome['error'] = sys.exc_info()
+
+    thread = threading.Thread(target=run)
+    thread.daemon = True
+    thread.start()
+
+    def result():
+        thread.join()
+        if 'error' in outcome:
+            error = outcome['error']
+            raise error[0], error[1], error[2]
+        return outcome['result']
+
+    return result
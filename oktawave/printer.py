@@ -1,18 +1,142 @@
+import csv
+import datetime
+import json
 import sys
-from prettytable import PrettyTable
+from collections import OrderedDict
+from contextlib import contextmanager
+from cStringIO import StringIO
+
+FORMATS = ('table', 'json', 'jsonl', 'csv', 'tsv')
+
+
+class RecordEncoder(json.JSONEncoder):
+    """Serialises API records, including dictionary items and dates"""
+
+    def default(self, o):
+        if hasattr(o, 'to_json'):
+            return o.to_json()
+        if isinstance(o, (datetime.datetime, datetime.date)):
+            return o.isoformat()
+        return unicode(o)
 
 
 class Printer:
-    def __init__(self, output=sys.stdout):
+    def __init__(self, output=sys.stdout, format='table'):
+        if format not in FORMATS:
+            raise ValueError('Unknown output format: %s' % format)
         self.output = output
+        self.format = format
+        # titles of the sections printed so far, see sections()
+        self.section_titles = None
 
     def _print(self, text):
         print >> self.output, text
 
+    @contextmanager
+    def sections(self):
+        """Groups the tables printed within into titled sections, see section()
+
+        In json output the sections make up a single object keyed by title,
+        jsonl records become {"section": title, "record": record} objects
+        and csv/tsv rows get a leading Section column.
+        """
+        self.section_titles = []
+        try:
+            yield
+        finally:
+            if self.format == 'json':
+                self._print('}' if self.section_titles else '{}')
+            self.section_titles = None
+
+    def section(self, title):
+        """Prints the title of the following table
+
+        Outside sections() the title is printed in the table format only,
+        so that other formats stay machine-readable.
+        """
+        if self.format == 'table':
+            self._print(title)
+        elif self.section_titles is not None:
+            title = title.strip()
+            if self.format == 'json':
+                self._print(('{' if not self.section_titles else ',') + json.dumps(title) + ':')
+            self.section_titles.append(title)
+
+    def notice(self, text):
+        """Prints a message for humans, e.g. that a listing is empty
+
+        Messages go to standard error in formats other than table.
+        """
+        if self.format == 'table':
+            self._print(text)
+        else:
+            print >> sys.stderr, text
+
+    def _section_title(self):
+        if self.section_titles:
+            return self.section_titles[-1]
+        return None
+
     def offset_print(self, text, offset=1):
         self._print(offset * ' ' + text)
 
+    def _print_json(self, record):
+        self._print(json.dumps(record, cls=RecordEncoder, ensure_ascii=False))
+        self.output.flush()
+
+    def _print_csv_row(self, row):
+        buf = StringIO()
+        writer = csv.writer(buf, delimiter='\t' if self.format == 'tsv' else ',', lineterminator='')
+        writer.writerow([unicode(col).encode('utf-8') for col in row])
+        self._print(buf.getvalue().decode('utf-8'))
+
+    def print_records(self, head, records, mapper_func):
+        """Prints records in the selected format as they are produced
+
+        Table formats (table, csv, tsv) print mapper_func(record) rows
+        under head, json and jsonl print the records themselves. Except
+        for "table", nothing is buffered. Returns True if any records were printed.
+        """
+        if self.format == 'table':
+            rows = map(mapper_func, records)
+            if rows:
+                self.print_table([head] + rows)
+            return bool(rows)
+
+        title = self._section_title()
+        if title is not None:
+            if self.format == 'jsonl':
+                records = (OrderedDict([('section', title), ('record', record)]) for record in records)
+            elif self.format in ('csv', 'tsv'):
+                head = ['Section'] + list(head)
+                row_func = mapper_func
+                mapper_func = lambda record: [title] + list(row_func(record))
+
+        found = False
+        if self.format == 'json':
+            for record in records:
+                self._print(('[' if not found else ',') + json.dumps(record, cls=RecordEncoder, ensure_ascii=False))
+                self.output.flush()
+                found = True
+            self._print(']' if found else '[]')
+        elif self.format == 'jsonl':
+            for record in records:
+                self._print_json(record)
+                found = True
+        else:
+            self._print_csv_row(head)
+            for record in records:
+                self._print_csv_row(mapper_func(record))
+                self.output.flush()
+                found = True
+        return found
+
     def print_table(self, data, hmarg=1):
+        if self.format != 'table':
+            self.print_rows(data[0], data[1:])
+            return
+        from prettytable import PrettyTable
+
         for i in xrange(hmarg):
             self._print('')
         x = PrettyTable(data[0])
@@ -23,10 +147,26 @@ class Printer:
             x.align = 'l'
         for row in data[1:]:
             x.add_row(row)
-        print unicode(x)
+        self._print(unicode(x))
         for i in xrange(hmarg):
             self._print('')
 
+    def print_rows(self, head, rows):
+        """Prints rows as soon as they are available
+
+        Unlike print_table, the rows do not have to be known upfront,
+        so the "table" format prints tab-separated columns. In json
+        formats every row is printed as an object keyed by head.
+        """
+        if self.format in ('json', 'jsonl'):
+            self.print_records(head, (OrderedDict(zip(head, row)) for row in rows), None)
+        elif self.format in ('csv', 'tsv'):
+            self.print_records(head, rows, list)
+        else:
+            self._print('\t'.join(head))
+            for row in rows:
+                self._print(u'\t'.join(unicode(col) for col in row))
+
     def print_hash_table(self, data, headers=None, order=False):
         if headers is None:
             headers = []
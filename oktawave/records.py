@@ -0,0 +1,134 @@
+from collections import OrderedDict
+
+
+class Record(object):
+    """Base class of compact, immutable API result records
+
+    Fields are kept in __slots__, so a record takes a fraction of the
+    memory of the equivalent dict. For backward compatibility records
+    can still be read like the dicts they replace: record['name'],
+    record.get('name'), 'name' in record, keys(), items(), dict(record).
+    Fields not given to the constructor are None.
+    """
+
+    __slots__ = ()
+
+    def __init__(self, *args, **kwargs):
+        if len(args) > len(self.__slots__):
+            raise TypeError('%s takes at most %d arguments' % (type(self).__name__, len(self.__slots__)))
+        for name, value in zip(self.__slots__, args):
+            kwargs[name] = value
+        for name in self.__slots__:
+            object.__setattr__(self, name, kwargs.pop(name, None))
+        if kwargs:
+            raise TypeError('%s got unexpected fields: %s' % (type(self).__name__, ', '.join(sorted(kwargs))))
+
+    def __setattr__(self, name, value):
+        raise AttributeError('%s is immutable' % type(self).__name__)
+
+    def __delattr__(self, name):
+        raise AttributeError('%s is immutable' % type(self).__name__)
+
+    def __getitem__(self, key):
+        if key not in self.__slots__:
+            raise KeyError(key)
+        return getattr(self, key)
+
+    def __contains__(self, key):
+        return key in self.__slots__
+
+    def __iter__(self):
+        return iter(self.__slots__)
+
+    def __len__(self):
+        return len(self.__slots__)
+
+    def get(self, key, default=None):
+        if key not in self.__slots__:
+            return default
+        return getattr(self, key)
+
+    def keys(self):
+        return list(self.__slots__)
+
+    def values(self):
+        return [getattr(self, name) for name in self.__slots__]
+
+    def items(self):
+        return [(name, getattr(self, name)) for name in self.__slots__]
+
+    def iteritems(self):
+        return ((name, getattr(self, name)) for name in self.__slots__)
+
+    def replace(self, **kwargs):
+        """Returns a copy of the record with some fields changed"""
+        values = dict(self.iteritems())
+        values.update(kwargs)
+        return type(self)(**values)
+
+    def to_json(self):
+        return OrderedDict(self.iteritems())
+
+    def __eq__(self, other):
+        if isinstance(other, Record):
+            return type(self) is type(other) and self.values() == other.values()
+        if isinstance(other, dict):
+            return self.to_json() == other
+        return NotImplemented
+
+    def __ne__(self, other):
+        res = self.__eq__(other)
+        if res is NotImplemented:
+            return res
+        return not res
+
+    __hash__ = None
+
+    def __getstate__(self):
+        return self.values()
+
+    def __setstate__(self, state):
+        for name, value in zip(self.__slots__, state):
+            object.__setattr__(self, name, value)
+
+    def __repr__(self):
+        return '%s(%s)' % (
+            type(self).__name__, ', '.join('%s=%r' % (name, value) for name, value in self.iteritems()))
+
+
+class VmSummary(Record):
+    __slots__ = ('id', 'name', 'status')
+
+
+class VmDetails(Record):
+    __slots__ = ('id', 'name', 'status', 'class_name', 'cpu_mhz', 'cpu_usage_mhz', 'memory_mb', 'memory_usage_mb')
+
+
+class VmInfo(Record):
+    __slots__ = VmDetails.__slots__ + (
+        'creation_date', 'last_change_date', 'creation_user_name', 'payment_type', 'autoscaling',
+        'connection_type', 'iops_usage')
+
+
+class Disk(Record):
+    __slots__ = ('id', 'name', 'tier', 'capacity_gb', 'used_gb', 'is_shared', 'vms')
+
+
+class DatabaseInstance(Record):
+    __slots__ = ('id', 'name', 'type', 'size', 'available_space')
+
+
+class LogicalDatabase(Record):
+    __slots__ = ('id', 'name', 'type', 'encoding', 'is_running', 'qps', 'size')
+
+
+class Container(Record):
+    __slots__ = ('id', 'name', 'vms')
+
+
+class Opn(Record):
+    __slots__ = ('id', 'name', 'address_pool', 'payment_type', 'vms')
+
+
+class HistoryEntry(Record):
+    __slots__ = ('time', 'type', 'user_name', 'status', 'parameters')
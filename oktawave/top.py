@@ -0,0 +1,195 @@
+import time
+
+from listing import Column
+
+
+def format_number(value, sign=False):
+    if value is None:
+        return ''
+    if isinstance(value, float):
+        return ('%+.1f' if sign else '%.1f') % value
+    return ('%+d' if sign else '%d') % value
+
+
+def percent(used, total):
+    if used is None or not total:
+        return None
+    return 100.0 * used / total
+
+
+def number_column(name, header, fields=None, value=None, sign=False):
+    """Returns a Column of numbers, formatted for the top view (with a sign for deltas)"""
+    column = Column(name, header, fields, value)
+    column.display = lambda record: format_number(column.value(record), sign)
+    column.numeric = True
+    return column
+
+
+def gauge_columns(name, header, unit):
+    """Returns the delta and rate columns of a gauge (see Sampler)"""
+    return [
+        number_column(name + '_delta', header + ' delta', sign=True),
+        number_column(name + '_rate', header + ' ' + unit + '/s', sign=True),
+    ]
+
+
+class Sampler(object):
+    """Polls a listing and computes per-row deltas and rates between samples
+
+    Arguments:
+    - fetch (function) - returns the current records
+    - key (function) - identifies the row of a record across samples
+    - gauges (list) - (field, name) pairs; every row gets name_delta
+      (change of the field since the previous sample) and name_rate
+      (the change per second), None for rows not seen before
+    """
+
+    def __init__(self, fetch, key, gauges):
+        self.fetch = fetch
+        self.key = key
+        self.gauges = gauges
+        self.previous = {}
+        self.previous_time = None
+        self.elapsed = None
+
+    def sample(self):
+        """Returns the current rows, as dicts of record fields, deltas and rates"""
+        now = time.time()
+        records = list(self.fetch())
+        self.elapsed = None if self.previous_time is None else now - self.previous_time
+        rows = []
+        for record in records:
+            row = dict(record.iteritems())
+            old = self.previous.get(self.key(row))
+            for field, name in self.gauges:
+                delta = rate = None
+                if old is not None and row[field] is not None and old[field] is not None:
+                    delta = row[field] - old[field]
+                    if self.elapsed:
+                        rate = delta / self.elapsed
+                row[name + '_delta'] = delta
+                row[name + '_rate'] = rate
+            rows.append(row)
+        self.previous = dict((self.key(row), row) for row in rows)
+        self.previous_time = now
+        return rows
+
+
+class TopScreen(object):
+    """Full-screen (curses) view of successive samples
+
+    Only the cells whose text changed since the previous screen are
+    written to the terminal. Keys: q quits, < and > choose the sort
+    column, r reverses the sort order.
+    """
+
+    HELP = 'q: quit, </>: sort column, r: reverse'
+
+    def __init__(self, title, sampler, query, interval, count=None):
+        """Initialize the screen
+
+        Arguments:
+        - title (string) - shown in the first line
+        - sampler (Sampler) - source of the rows
+        - query (ListQuery) - filters, sorts, limits and formats the rows
+        - interval (float) - seconds between samples
+        - count (int) - exit after this many samples (optional)
+        """
+        self.title = title
+        self.sampler = sampler
+        self.query = query
+        self.interval = interval
+        self.count = count
+        self.cells = {}
+        self.widths = [len(column.header) for column in query.selected]
+
+    def run(self):
+        import curses
+        curses.wrapper(self._main)
+
+    def _main(self, screen):
+        import curses
+        try:
+            curses.curs_set(0)
+        except curses.error:
+            pass
+        samples = 0
+        while self.count is None or samples < self.count:
+            rows = self.sampler.sample()
+            samples += 1
+            self._draw(screen, rows)
+            deadline = time.time() + self.interval
+            while True:
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    break
+                screen.timeout(int(remaining * 1000) + 1)
+                key = screen.getch()
+                if key in (ord('q'), ord('Q')):
+                    return
+                if key in (ord('<'), ord('>'), ord('r'), ord('R')):
+                    self._change_sort(key)
+                elif key == curses.KEY_RESIZE:
+                    self.cells = {}
+                    screen.clear()
+                else:
+                    continue
+                self._draw(screen, rows)
+
+    def _change_sort(self, key):
+        selected = self.query.selected
+        column, descending = self.query.sort[0] if self.query.sort else (selected[0], False)
+        if key in (ord('r'), ord('R')):
+            descending = not descending
+        else:
+            pos = selected.index(column) if column in selected else 0
+            pos = (pos + (1 if key == ord('>') else -1)) % len(selected)
+            column = selected[pos]
+        self.query.sort = [(column, descending)]
+
+    def _status(self, count):
+        if self.query.sort:
+            column, descending = self.query.sort[0]
+            order = '%s %s' % (column.name, 'descending' if descending else 'ascending')
+        else:
+            order = 'none'
+        return '%s - %s - %d rows, every %gs, sorted by %s (%s)' % (
+            self.title, time.strftime('%H:%M:%S'), count, self.interval, order, self.HELP)
+
+    def _draw(self, screen, rows):
+        import curses
+        rows = [self.query.row(row) for row in self.query.apply(rows)]
+        lines = [[self._status(len(rows))], [column.header for column in self.query.selected]]
+        numeric = [getattr(column, 'numeric', False) for column in self.query.selected]
+        for row in rows:
+            lines.append([unicode(cell) for cell in row])
+            for i, cell in enumerate(lines[-1]):
+                self.widths[i] = max(self.widths[i], len(cell))
+
+        height, width = screen.getmaxyx()
+        lines = lines[:height]
+        for y, cells in enumerate(lines):
+            x = 0
+            for i, cell in enumerate(cells):
+                if x >= width:
+                    break
+                if y == 0:
+                    text = cell.ljust(width)
+                else:
+                    text = cell.rjust(self.widths[i]) if numeric[i] else cell.ljust(self.widths[i])
+                    text += ' '
+                if self.cells.get((y, x)) != text:
+                    try:
+                        screen.addnstr(y, x, text.encode('utf-8'), width - x, curses.A_BOLD if y < 2 else 0)
+                    except curses.error:
+                        # writing the bottom right corner moves the cursor off the screen
+                        pass
+                    self.cells[(y, x)] = text
+                x += len(text)
+
+        # drop the rows which are gone since the previous screen
+        if len(lines) < height and any(y >= len(lines) for y, _x in self.cells):
+            screen.move(len(lines), 0)
+            screen.clrtobot()
+            self.cells = dict(item for item in self.cells.iteritems() if item[0][0] < len(lines))
+        screen.refresh()
@@ -0,0 +1,103 @@
+from time import time, sleep
+
+
+class OperationWaiter(object):
+    """Waits for asynchronous operations to finish
+
+    A single poller of Account_RunningJobs (GetRunningOperations) tracks
+    the operations on the objects passed to track() which were started
+    after start() was called, so the cost of waiting does not depend on
+    the number of pending operations. Operations started by other users
+    or scripts on other objects are not waited for.
+    The polling interval grows while nothing changes and drops back
+    to the minimum as soon as any operation makes progress.
+    """
+
+    MIN_INTERVAL = 1.0
+    MAX_INTERVAL = 15.0
+    BACKOFF = 1.5
+    # how long to wait for the first operation to show up
+    GRACE_PERIOD = 10.0
+
+    def __init__(self, api, timeout=None, report=None):
+        """Initialize the waiter
+
+        Arguments:
+        - api (OktawaveApi) - logged on API instance
+        - timeout (int) - maximum number of seconds to wait (None waits forever)
+        - report (callable) - called as report(op, finished) whenever
+          an operation makes progress or finishes (optional)
+        """
+        self.api = api
+        self.timeout = timeout
+        self.report = report
+        self.baseline = set()
+        self.object_ids = set()
+        self.object_names = set()
+
+    def track(self, object_ids=(), object_names=()):
+        """Adds objects (VMs, disks, ...) whose operations should be waited for
+
+        Arguments:
+        - object_ids (list of ints) - IDs of the objects
+        - object_names (list of strings) - names of the objects
+        """
+        self.object_ids.update(object_ids)
+        self.object_names.update(object_names)
+
+    def _running(self):
+        return dict((op['id'], op) for op in self.api.Account_RunningJobs())
+
+    def _tracked(self, op):
+        return op['object_id'] in self.object_ids or op['object_name'] in self.object_names
+
+    def start(self):
+        """Remembers the operations already running, so they are not waited for"""
+        self.baseline = set(self._running())
+
+    def wait(self):
+        """Polls until the operations on tracked objects started after start() finish
+
+        Returns True if they all finished, False on timeout. An operation
+        may show up a while after the call starting it returned, so
+        polling goes on for GRACE_PERIOD seconds until one is seen.
+        """
+        if not self.object_ids and not self.object_names:
+            return True
+        started = time()
+        deadline = None if self.timeout is None else started + self.timeout
+        interval = self.MIN_INTERVAL
+        tracked = {}
+        seen = False
+        while True:
+            pending = dict(
+                (op_id, op) for op_id, op in self._running().iteritems()
+                if op_id not in self.baseline and self._tracked(op))
+            seen = seen or bool(pending)
+
+            changed = False
+            for op_id in sorted(pending):
+                op = pending[op_id]
+                last = tracked.get(op_id)
+                if last is None or last['progress_percent'] != op['progress_percent']:
+                    changed = True
+                    if self.report is not None:
+                        self.report(op, False)
+                tracked[op_id] = op
+            for op_id in sorted(set(tracked) - set(pending)):
+                changed = True
+                if self.report is not None:
+                    self.report(tracked.pop(op_id), True)
+
+            if not pending and (seen or time() - started >= self.GRACE_PERIOD):
+                return True
+            if deadline is not None and time() >= deadline:
+                return False
+
+            if changed:
+                interval = self.MIN_INTERVAL
+            else:
+                interval = min(interval * self.BACKOFF, self.MAX_INTERVAL)
+            if deadline is not None:
+                interval = max(0, min(interval, deadline - time()))
+            sleep(interval)